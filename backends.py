@@ -0,0 +1,183 @@
+import asyncio
+import importlib
+import logging
+import os
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Backends used when BACKENDS is not set, see parse_backends
+DEFAULT_BACKENDS = "mistral:mistral-tiny*4"
+
+
+class MistralBackend:
+    """Streams chat completions from the Mistral API."""
+
+    kind = "mistral"
+    # Client modules imported by stream, preloaded in the background by import_backend_modules
+    modules = ("mistralai.async_client", "mistralai.models.chat_completion")
+
+    def __init__(self, model: str, api_key: str, endpoint: str = "https://api.mistral.ai", slots: int = 4):
+        self.model = model
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.slots = slots
+
+    async def stream(self, messages: list):
+        """Yields the content of the completion for `messages` ([{"role": ..., "content": ...}]) as it arrives."""
+        # Import necessary modules for message processing
+        from mistralai.async_client import MistralAsyncClient
+        from mistralai.models.chat_completion import ChatMessage
+
+        client = MistralAsyncClient(api_key=self.api_key, endpoint=self.endpoint)
+        async for chunk in client.chat_stream(model=self.model, messages=[ChatMessage(**message) for message in messages]):
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+
+
+class OllamaBackend:
+    """Streams chat completions from a local Ollama model."""
+
+    kind = "ollama"
+    modules = ("ollama",)
+
+    def __init__(self, model: str, host: str = None, slots: int = 1, warmer=None):
+        self.model = model
+        self.host = host
+        self.slots = slots
+        self.warmer = warmer
+
+    async def stream(self, messages: list):
+        from ollama import AsyncClient
+
+        options = {}
+        if self.warmer is not None:
+            self.warmer.touch(self.model)
+            options["keep_alive"] = self.warmer.keep_alive(self.model)
+        async for part in await AsyncClient(host=self.host).chat(model=self.model, messages=messages, stream=True, **options):
+            content = part['message']['content']
+            if content:
+                yield content
+
+
+def import_backend_modules(backends: list, extra: tuple = ()) -> None:
+    """
+    Imports the client libraries of `backends` (and the `extra` modules) ahead of the first request.
+    Blocking, run it in a thread so startup does not wait for the heavy imports.
+    """
+    names = {name for backend in backends for name in backend.modules} | set(extra)
+    for name in sorted(names):
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f"Could not preload {name}: {e}")
+
+
+def parse_backends(spec: str, api_key: str = None, endpoint: str = None, warmer=None) -> list:
+    """
+    Creates the backends listed in `spec`, a comma separated list of kind:model*slots,
+    e.g. "mistral:mistral-tiny*4,ollama:openhermes*2". Ollama models are registered with `warmer`.
+    """
+    backends = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, model = item.partition(":")
+        model, _, slots = model.partition("*")
+        slots = int(slots or 1)
+        if kind == "mistral":
+            backends.append(MistralBackend(model, api_key, endpoint, slots))
+        elif kind == "ollama":
+            backends.append(OllamaBackend(model, os.environ.get("OLLAMA_HOST"), slots, warmer))
+            if warmer is not None:
+                warmer.add(model)
+        else:
+            raise ValueError(f"Unknown backend: {item}")
+    return backends
+
+
+class BackendPool:
+    """
+    Shares the generation slots of several backends between the tenants (bots) of the process.
+    Every backend contributes `slots` slots; a request takes a slot, so the number of concurrent
+    requests per backend is capped and the load is spread across backends.
+    When all slots are busy, freed slots are handed out fair-share: the waiting tenant that
+    received the fewest slots relative to its weight goes first, so one busy bot cannot starve the others.
+    """
+
+    def __init__(self, backends: list, weights: dict = None):
+        self.backends = backends
+        self.free = deque()
+        # Interleave the backends so consecutive requests go to different backends
+        for i in range(max(backend.slots for backend in backends)):
+            for backend in backends:
+                if i < backend.slots:
+                    self.free.append(backend)
+        self.weights = dict(weights or {})
+        # Waiting requests and virtual time (slots received / weight) per tenant
+        self.waiting = {}
+        self.served = {}
+        self.clock = 0.0
+
+    async def acquire(self, tenant: str = None):
+        """Waits for a free slot and returns its backend."""
+        if self.free and not self.waiting:
+            self._grant(tenant)
+            return self.free.popleft()
+        if tenant not in self.waiting:
+            # A tenant that was idle does not get credit for the time it did not use
+            self.served[tenant] = max(self.served.get(tenant, 0.0), self.clock)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(tenant, deque()).append(future)
+        metrics.inc(f"backend_waits.{tenant or 'default'}")
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted right before the cancellation, pass it on
+                self.release(future.result())
+            else:
+                self._remove_waiter(tenant, future)
+            raise
+
+    def release(self, backend) -> None:
+        """Returns the slot of `backend`, handing it to the next waiting tenant."""
+        while self.waiting:
+            tenant = min(self.waiting, key=lambda name: self.served[name])
+            future = self.waiting[tenant].popleft()
+            if not self.waiting[tenant]:
+                del self.waiting[tenant]
+            # Waiters cancelled in the same tick (e.g. by drain) are still queued
+            if future.done():
+                continue
+            self._grant(tenant)
+            future.set_result(backend)
+            return
+        self.free.append(backend)
+
+    async def stream(self, messages: list, tenant: str = None):
+        """Streams a completion from the first backend with a free slot."""
+        backend = await self.acquire(tenant)
+        metrics.inc(f"backend_requests.{backend.kind}.{backend.model}")
+        try:
+            async for content in backend.stream(messages):
+                yield content
+        finally:
+            self.release(backend)
+
+    async def complete(self, messages: list, tenant: str = None) -> str:
+        """Returns the whole completion for `messages`."""
+        return "".join([content async for content in self.stream(messages, tenant)])
+
+    def _grant(self, tenant: str) -> None:
+        served = max(self.served.get(tenant, 0.0), self.clock)
+        self.clock = served
+        self.served[tenant] = served + 1 / self.weights.get(tenant, 1)
+
+    def _remove_waiter(self, tenant: str, future) -> None:
+        waiters = self.waiting.get(tenant)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self.waiting[tenant]
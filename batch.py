@@ -0,0 +1,138 @@
+"""
+Runs the Briefify pipeline over a JSONL file of prompts, outside Telegram.
+
+    python batch.py prompts.jsonl -o results.jsonl --concurrency 8 --checkpoint done.txt
+
+Each input line is {"id": ..., "prompt": "...", "language": "en"} (id and language are optional).
+Results are written as JSONL in completion order; malformed lines get an error result
+with their line number as id. With --checkpoint, finished IDs are
+recorded and skipped when the batch is restarted.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from time import perf_counter
+
+from backends import BackendPool, parse_backends, DEFAULT_BACKENDS
+from bot_conv import lang_config
+from prompting import estimate_tokens, prepare_prompt, pool_budget
+from summarize import split_chunks, chunk_budget, summarize
+
+
+async def run_prompt(pool: BackendPool, prompt: str, language: str) -> str:
+    """Answers a prompt like handle_message does: texts over the budget are summarized in chunks."""
+    budget = pool_budget(pool.backends)
+    prompt, tokens = prepare_prompt(prompt, budget)
+    if tokens > budget:
+        max_tokens = chunk_budget(budget)
+        stream = summarize(split_chunks([prompt], max_tokens), pool, lang_config.get(language, language), max_tokens=max_tokens)
+    else:
+        stream = pool.stream([{"role": "user", "content": prompt}])
+    return "".join([content async for content in stream])
+
+async def read_prompts(file, queue: asyncio.Queue, done_ids: set, workers: int) -> None:
+    """Streams the input lines into `queue` without blocking the event loop."""
+    line_number = 0
+    while line := await asyncio.to_thread(file.readline):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            item = {"error": f"Invalid JSON: {e}"}
+        if not isinstance(item, dict):
+            item = {"error": f"Expected a JSON object, got {type(item).__name__}"}
+        item.setdefault("id", line_number)
+        if str(item["id"]) not in done_ids:
+            await queue.put(item)
+    for _ in range(workers):
+        await queue.put(None)
+
+async def worker(pool: BackendPool, queue: asyncio.Queue, output, checkpoint, stats: list) -> None:
+    while (item := await queue.get()) is not None:
+        started = perf_counter()
+        result = {"id": item["id"]}
+        try:
+            if "error" in item:
+                raise ValueError(item["error"])
+            result["output"] = await run_prompt(pool, item["prompt"], item.get("language", "en"))
+        except Exception as e:
+            result["error"] = str(e)
+        result["latency"] = round(perf_counter() - started, 3)
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        if checkpoint is not None and "error" not in result:
+            checkpoint.write(f"{item['id']}\n")
+            checkpoint.flush()
+        stats.append((result["latency"], estimate_tokens(result.get("output", "")), "error" in result))
+
+def report(stats: list, elapsed: float) -> str:
+    if not stats:
+        return "No prompts processed"
+    latencies = sorted(latency for latency, _, _ in stats)
+    tokens = sum(tokens for _, tokens, _ in stats)
+    errors = sum(1 for _, _, error in stats if error)
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    return (
+        f"Processed {len(stats)} prompts ({errors} errors) in {elapsed:.1f}s\n"
+        f"Throughput: {len(stats) / elapsed:.2f} prompts/s, {tokens / elapsed:.1f} tokens/s (estimated)\n"
+        f"Latency: p50 {percentile(0.5):.2f}s, p95 {percentile(0.95):.2f}s, max {latencies[-1]:.2f}s"
+    )
+
+async def run_batch(args) -> None:
+    backends = parse_backends(
+        args.backends,
+        api_key=os.environ.get("MISTRAL_API_KEY"),
+        endpoint=os.environ.get("MISTRAL_ENDPOINT", "https://api.mistral.ai"),
+    )
+    pool = BackendPool(backends)
+    # Fails before reading any prompt when the budget leaves no room for summary chunks
+    chunk_budget(pool_budget(backends))
+    concurrency = args.concurrency or sum(backend.slots for backend in backends)
+
+    done_ids = set()
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        with open(args.checkpoint) as file:
+            done_ids = {line.strip() for line in file if line.strip()}
+    checkpoint = open(args.checkpoint, "a") if args.checkpoint else None
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    # Append when resuming, so the results of the previous run are kept
+    output = sys.stdout if args.output == "-" else open(args.output, "a" if done_ids else "w", encoding="utf-8")
+
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = []
+    started = perf_counter()
+    tasks = [
+        asyncio.create_task(read_prompts(source, queue, done_ids, concurrency)),
+        *(asyncio.create_task(worker(pool, queue, output, checkpoint, stats)) for _ in range(concurrency)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # A failed reader or worker stops the others instead of leaving them waiting on the queue
+        for task in tasks:
+            task.cancel()
+        for file in (source, output, checkpoint):
+            if file not in (None, sys.stdin, sys.stdout):
+                file.close()
+    print(report(stats, perf_counter() - started), file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the Briefify pipeline over a JSONL file of prompts.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file with prompts, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file for the results, - for stdout")
+    parser.add_argument("--concurrency", type=int, default=0, help="number of workers, defaults to the backend slots")
+    parser.add_argument("--checkpoint", help="file recording finished prompt IDs, used to resume a batch")
+    parser.add_argument("--backends", default=os.environ.get("BACKENDS", DEFAULT_BACKENDS), help="backend spec, see backends.parse_backends")
+    asyncio.run(run_batch(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
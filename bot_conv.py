@@ -29,6 +29,42 @@ restriction_end_message = {
     'fr' : "✅ Votre restriction est terminée, vous pouvez maintenant utiliser le bot encore une fois",
 }
 
+summary_progress = {
+    'en': "📄 Summarizing... {done}/{total} parts done",
+    'ru': "📄 Составляю краткое содержание... готово {done}/{total} частей",
+    'fr': "📄 Résumé en cours... {done}/{total} parties terminées",
+}
+
+unsupported_document = {
+    'en': "⚠️ I can only summarize TXT, PDF and DOCX files.",
+    'ru': "⚠️ Я могу кратко пересказать только файлы TXT, PDF и DOCX.",
+    'fr': "⚠️ Je ne peux résumer que des fichiers TXT, PDF et DOCX.",
+}
+
+empty_document = {
+    'en': "⚠️ I couldn't find any text in this document.",
+    'ru': "⚠️ Я не нашёл текста в этом документе.",
+    'fr': "⚠️ Je n'ai trouvé aucun texte dans ce document.",
+}
+
+voice_too_long = {
+    'en': "⚠️ Voice messages can be at most {max_minutes} minutes long.",
+    'ru': "⚠️ Голосовые сообщения могут длиться не более {max_minutes} минут.",
+    'fr': "⚠️ Les messages vocaux ne peuvent pas dépasser {max_minutes} minutes.",
+}
+
+voice_busy = {
+    'en': "⏳ Too many voice messages are being transcribed right now. Please try again in a minute.",
+    'ru': "⏳ Сейчас распознаётся слишком много голосовых сообщений. Попробуйте через минуту.",
+    'fr': "⏳ Trop de messages vocaux sont en cours de transcription. Réessayez dans une minute.",
+}
+
+voice_not_recognized = {
+    'en': "⚠️ I couldn't recognize any speech in this voice message.",
+    'ru': "⚠️ Я не смог распознать речь в этом голосовом сообщении.",
+    'fr': "⚠️ Je n'ai reconnu aucune parole dans ce message vocal.",
+}
+
 continue_text = {
     'en': "Continue in English",
     'ru': "Продолжить на русском",
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+from collections import deque
+
+from telegram.ext import ApplicationHandlerStop
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Processed updates are remembered in this file across restarts, not persisted if empty
+UPDATE_LOG_PATH = os.environ.get("UPDATE_LOG_PATH", "update_log.json")
+# Number of processed keys remembered, redelivered updates are always recent
+UPDATE_LOG_SIZE = int(os.environ.get("UPDATE_LOG_SIZE", 10000))
+# Telegram redelivers pending updates right after startup, later the interrupted ones are given up (seconds)
+STALE_UPDATE_WINDOW = float(os.environ.get("STALE_UPDATE_WINDOW", 60))
+
+
+def update_keys(update) -> list:
+    """Returns the keys identifying an update: its update_id and, for messages, (chat_id, message_id)."""
+    keys = [f"u{update.update_id}"]
+    message = update.message
+    if message is not None:
+        keys.append(f"m{message.chat_id}:{message.message_id}")
+    return keys
+
+
+class UpdateLog:
+    """
+    Bounded record of processed updates used to skip updates that Telegram redelivers
+    after a crash or restart.
+    Updates are "in flight" from the moment they are accepted until their handler (or the
+    generation it started) has finished. In-flight updates of a previous run are processed
+    again; the partial replies they left are deleted first, so every message gets one answer.
+    Partial replies of in-flight updates that are not redelivered within STALE_UPDATE_WINDOW
+    are deleted by `expire_stale`.
+    """
+
+    def __init__(self, path: str = UPDATE_LOG_PATH, size: int = UPDATE_LOG_SIZE):
+        self.path = path
+        self.done = deque(maxlen=size)
+        self.done_keys = set()
+        self.in_flight = {}
+        self.stale = {}
+        self.deferred = set()
+        # Set when the log changed since it was last saved
+        self.dirty = False
+        self.load()
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading the update log: {e}")
+            return
+        for key in state.get("done", []):
+            self._add_done(key)
+        # Updates that were still being processed when the previous run ended
+        self.stale = state.get("in_flight", {})
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        # in_flight holds every key of an entry, store each entry once under all its keys
+        in_flight = {}
+        for key, entry in self.in_flight.items():
+            in_flight[key] = {"chat_id": entry["chat_id"], "messages": _reply_ids(entry["reply"])}
+        # Stale entries are kept until they are redelivered or expire, also across a quick restart
+        state = {"done": list(self.done), "in_flight": {**self.stale, **in_flight}}
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary_path, self.path)
+        self.dirty = False
+
+    async def check(self, update, context) -> None:
+        """
+        TypeHandler callback, registered in a group before the other handlers.
+        Stops the processing of updates that were already handled or are being handled.
+        """
+        keys = update_keys(update)
+        if any(key in self.done_keys or key in self.in_flight for key in keys):
+            metrics.inc("updates_deduplicated")
+            raise ApplicationHandlerStop
+        # The entry of an update interrupted in the previous run is stored under all its keys
+        stale = [self.stale.pop(key, None) for key in keys]
+        stale = next((entry for entry in stale if entry is not None), None)
+        if stale is not None:
+            metrics.inc("updates_resumed")
+            await self._clean_up(context.bot, stale)
+        entry = {
+            "keys": keys,
+            "chat_id": update.effective_chat.id if update.effective_chat else None,
+            "reply": None,
+        }
+        for key in keys:
+            self.in_flight[key] = entry
+        self.dirty = True
+
+    async def complete(self, update, context) -> None:
+        """
+        TypeHandler callback, registered in a group after the other handlers.
+        Finishes the update unless a background generation took it over.
+        """
+        if _update_key(update) not in self.deferred:
+            self.finish(update)
+
+    def defer(self, update) -> None:
+        """Marks `update` as finished by a background generation, which calls `finish` itself."""
+        self.deferred.add(_update_key(update))
+
+    def track_reply(self, update, reply) -> None:
+        """Remembers the reply (StreamRenderer) of an in-flight update, to clean it up after a crash."""
+        entry = self.in_flight.get(_update_key(update))
+        if entry is not None:
+            entry["reply"] = reply
+            self.dirty = True
+
+    def finish(self, update) -> None:
+        key = _update_key(update)
+        self.deferred.discard(key)
+        entry = self.in_flight.get(key)
+        for done_key in entry["keys"] if entry else update_keys(update):
+            self.in_flight.pop(done_key, None)
+            self._add_done(done_key)
+        self.dirty = True
+
+    async def expire_stale(self, context) -> None:
+        """
+        JobQueue callback, run STALE_UPDATE_WINDOW seconds after startup.
+        Deletes the partial replies of the interrupted updates Telegram did not redeliver.
+        """
+        stale, self.stale = self.stale, {}
+        self.dirty = self.dirty or bool(stale)
+        # Every entry is stored under all the keys of its update
+        entries = {(entry["chat_id"], tuple(entry.get("messages", []))): entry for entry in stale.values()}
+        for entry in entries.values():
+            metrics.inc("updates_expired")
+            await self._clean_up(context.bot, entry)
+
+    async def flush(self, context=None) -> None:
+        """Writes the log to disk if it changed. Also used as JobQueue callback."""
+        # A streamed reply may have grown new pages since the last save
+        if not self.dirty and not any(entry["reply"] is not None for entry in self.in_flight.values()):
+            return
+        try:
+            self.save()
+        except OSError as e:
+            logger.error(f"Error saving the update log: {e}")
+
+    def _add_done(self, key: str) -> None:
+        if len(self.done) == self.done.maxlen:
+            self.done_keys.discard(self.done[0])
+        self.done.append(key)
+        self.done_keys.add(key)
+
+    async def _clean_up(self, bot, stale: dict) -> None:
+        """Deletes the partial replies an interrupted update left behind."""
+        for message_id in stale.get("messages", []):
+            try:
+                await bot.delete_message(chat_id=stale["chat_id"], message_id=message_id)
+            except Exception as e:
+                logger.warning(f"Could not delete a partial reply: {e}")
+
+
+def _update_key(update) -> str:
+    return f"u{update.update_id}"
+
+def _reply_ids(reply) -> list:
+    return list(reply.message_ids) if reply is not None else []
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# How long in-flight generations may continue after a stop signal (seconds)
+DRAIN_GRACE_PERIOD = float(os.environ.get("DRAIN_GRACE_PERIOD", 30))
+INTERRUPTED_MARKER = "\n\n(interrupted)"
+
+
+class GenerationTracker:
+    """
+    Tracks the background generation tasks and the replies they stream.
+    On shutdown `drain` stops accepting new generations, lets the running ones finish
+    within the grace period and marks the replies of the cancelled ones as interrupted.
+    """
+
+    def __init__(self):
+        self.accepting = True
+        self.tasks = set()
+        self.replies = {}
+
+    def spawn(self, coroutine):
+        """Runs `coroutine` as a tracked task. Returns None if the bot is shutting down."""
+        if not self.accepting:
+            coroutine.close()
+            metrics.inc("generations_rejected")
+            return None
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+        metrics.set_gauge("generations_in_flight", len(self.tasks))
+        return task
+
+    def attach(self, reply) -> None:
+        """Associates a reply (StreamRenderer) with the running task, so it can be finalized on shutdown."""
+        task = asyncio.current_task()
+        if task in self.tasks:
+            self.replies[task] = reply
+
+    def _done(self, task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled():
+            self.replies.pop(task, None)
+        metrics.set_gauge("generations_in_flight", len(self.tasks))
+
+    async def drain(self, grace_period: float = DRAIN_GRACE_PERIOD) -> None:
+        self.accepting = False
+        if self.tasks:
+            logger.info("Waiting up to %ss for %d generations to finish", grace_period, len(self.tasks))
+            _, pending = await asyncio.wait(set(self.tasks), timeout=grace_period)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            metrics.inc("generations_interrupted", len(pending))
+        # Close the replies of the cancelled generations
+        replies, self.replies = self.replies, {}
+        for reply in replies.values():
+            try:
+                await reply.finish(INTERRUPTED_MARKER)
+            except Exception as e:
+                logger.error(f"Error finalizing interrupted reply: {e}")
+
+
+# Shared tracker of the background generations
+generations = GenerationTracker()
@@ -1,16 +1,18 @@
+# Must be the first import, times the imports with --profile-startup
+import startup
+import argparse
 import asyncio
 import logging
+import signal
 from typing import Optional, Tuple
 import os 
-from time import time
-import ollama
+from time import time, perf_counter, monotonic
 from io import BytesIO
 from telegram import (
     Chat, 
     ChatMember, 
     ChatMemberUpdated, 
     Update,
-    InlineKeyboardMarkup, 
     constants,
  )
 
@@ -24,12 +26,28 @@ from telegram.ext import (
     filters,
     CallbackContext,
     CallbackQueryHandler,
-    ApplicationHandlerStop
+    TypeHandler,
+    PicklePersistence,
+    PersistenceInput
 )
-from utils import message_text, keyboard_layout
-from bot_conv import *
-from datetime import datetime
+from utils import message_text
+from datetime import datetime, timedelta
 import json
+import metrics
+from warmup import ModelWarmer
+from media_group import MediaGroupCollector
+from profiling import profiler, PROFILING_ENABLED
+from update_trace import TraceRecorder, TRACE_RECORD_PATH
+from sessions import SessionContext
+from backends import BackendPool, parse_backends, import_backend_modules, DEFAULT_BACKENDS
+from streaming import StreamRenderer
+from lifecycle import generations
+from telegram_requests import request_from_env
+from tenants import Tenant, TenantApplication, tenant_from_env, load_tenants, TENANTS_CONFIG
+from summarize import extract_text, split_chunks, chunk_budget, summarize, UnsupportedDocument, SUPPORTED_EXTENSIONS
+from prompting import prepare_prompt, pool_budget
+from transcribe import transcriber, TranscriberBusy, MAX_VOICE_DURATION
+from idempotency import STALE_UPDATE_WINDOW
 
 # Enable logging
 logging.basicConfig(
@@ -40,19 +58,36 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN") 
-SUPPORTED_LANGUAGES = ['en', 'ru', 'fr']
-GITHUB_REPO = "https://github.com/RusaUB/BriefifyBot"
-ADMIN_ID = os.environ.get("TELEGRAM_ADMIN_ID")
-
-# Initialize Mistral client and model
+# Mistral credentials and the vision model
 api_key = os.environ["MISTRAL_API_KEY"]
-model = "mistral-tiny"
+mistral_endpoint = os.environ.get("MISTRAL_ENDPOINT", "https://api.mistral.ai")
+vision_model = "llava"
+
+# Preloads the local Ollama models and keeps them warm
+warmer = ModelWarmer([vision_model])
+
+# Text generation backends, e.g. BACKENDS="mistral:mistral-tiny*4,ollama:openhermes*2"
+# Shared by the bots of all tenants, see tenants.py
+backends = parse_backends(os.environ.get("BACKENDS", DEFAULT_BACKENDS), api_key=api_key, endpoint=mistral_endpoint, warmer=warmer)
+backend_pool = BackendPool(backends)
+# Max input tokens of a request, see prompting.py
+prompt_budget = pool_budget(backends)
+# Chunk size of the summarized texts, so every summary request fits the budget too
+# Checked here, a budget without room for text would otherwise only fail on the first long message
+summary_chunk_tokens = chunk_budget(prompt_budget)
+
+# Connection pool for the Bot API calls of all tenants, the token is part of the URL
+# Separate from the get_updates pools, so the long polling never competes with the edits of the streams
+bot_api_request = request_from_env("bot_api", "TELEGRAM_SEND", pool_size=256, timeout=10)
 
-# Restriction settings
-MAX_USAGE = 30 # 30 messages
-RATE_INTERVAL = 60 # 60 minutes
+# Records the incoming updates for replay.py, see update_trace.py
+recorder = TraceRecorder(TRACE_RECORD_PATH) if TRACE_RECORD_PATH else None
+
+# Number of days the per-user message counts are kept
+STATS_RETENTION_DAYS = 7
+
+# Minimum seconds between two progress updates of a summary
+PROGRESS_INTERVAL = 2
 
 async def handle_error(update, context, error_message, reply = True):
     """
@@ -111,11 +146,11 @@ async def track_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         if not was_member and is_member:
             # Log when user unblocks the bot
             logger.info("%s unblocked the bot", cause_name)
-            context.bot_data.setdefault("user_ids", set()).add(chat.id)
+            del context.user_data["blocked"]
         elif was_member and not is_member:
             # Log when user blocks the bot
             logger.info("%s blocked the bot", cause_name)
-            context.bot_data.setdefault("user_ids", set()).discard(chat.id)
+            context.user_data["blocked"] = True
     elif chat.type in [Chat.GROUP, Chat.SUPERGROUP]:
         if not was_member and is_member:
             # Log when bot is added to group
@@ -138,11 +173,11 @@ async def track_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 async def show_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         """Shows which chats the bot is in"""
-        user_ids = ", ".join(str(uid) for uid in context.bot_data.setdefault("user_ids", set()))
+        total_users = context.tenant.sessions.count()
         group_ids = ", ".join(str(gid) for gid in context.bot_data.setdefault("group_ids", set()))
         channel_ids = ", ".join(str(cid) for cid in context.bot_data.setdefault("channel_ids", set()))
         text = (
-            f"@{context.bot.username} is currently in a conversation with the user IDs {user_ids}."
+            f"@{context.bot.username} is currently in a conversation with {total_users} users."
             f" Moreover it is a member of the groups with IDs {group_ids} "
             f"and administrator in the channels with IDs {channel_ids}."
         )
@@ -183,34 +218,27 @@ async def start_private_chat(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Extract user, chat, and language info from the update
         user = update.effective_user
         chat = update.effective_chat
-        language_code = user.language_code if user.language_code in SUPPORTED_LANGUAGES else "en"
+        tenant = context.tenant
+        language_code = tenant.user_language(user)
 
         if context.user_data.get("language"):
-            if chat.type != Chat.PRIVATE or chat.id in context.bot_data.get("user_ids", set()):
+            if chat.type != Chat.PRIVATE or context.user_data.get("startedAt"):
                 await update.message.reply_text(
                     message_text(
                         language_code=language_code,
-                        message=start_page,
-                        context={"user": user, "github_repo": GITHUB_REPO}
+                        message=tenant.start_pages,
+                        context={"user": user}
                     ),
                     parse_mode=constants.ParseMode.MARKDOWN
                 )
                 return
-        # Record chat start time
-        current_datetime = datetime.now()
-        start_date = current_datetime.strftime('%Y-%m-%d')
-        start_time = current_datetime.strftime('%H:%M')
-        # Record chat start time in context bot data
-        context.bot_data.setdefault("user_ids", {}).setdefault(chat.id, {}).update({
-            "start_date": start_date,
-            "start_time": start_time
-        })
-        
-        keyboard = keyboard_layout(language_code, SUPPORTED_LANGUAGES, lang_config, continue_text)
-        
+        # Record chat start time in the user session
+        if chat.type == Chat.PRIVATE and not context.user_data.get("startedAt"):
+            context.user_data["startedAt"] = time()
+
         await update.message.reply_text(
-            message_text(language_code, bot_greeting, context={"user": user}),
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            message_text(language_code, tenant.messages["bot_greeting"], context={"user": user}),
+            reply_markup=tenant.language_keyboards[language_code]
         )
     except Exception as e:
         await handle_error(update, context, f"Error starting private chat: {e}")
@@ -234,8 +262,8 @@ async def handle_language_selection(update: Update, context: CallbackContext) ->
         await query.message.edit_text(
             message_text(
                 language_code=lang_choice,
-                message=start_page,
-                context={"user": update.effective_user.full_name, "github_repo": GITHUB_REPO}
+                message=context.tenant.start_pages,
+                context={"user": update.effective_user.full_name}
             ),
             parse_mode=constants.ParseMode.MARKDOWN
         )
@@ -243,132 +271,304 @@ async def handle_language_selection(update: Update, context: CallbackContext) ->
         # Handle any errors that may occur
         await handle_error(update, context, f"Error handling language selection: {e}")
 
+async def check_usage(update: Update, context: CallbackContext) -> bool:
+    """
+    Checks the rate limit of the user and counts the request.
+    Returns False (after notifying the user) if the user is restricted.
+    """
+    tenant = context.tenant
+    count = context.user_data.get("usageCount", 0) 
+    restrict_since = context.user_data.get("restrictSince", 0)
+    if restrict_since:
+        time_left = (restrict_since + tenant.restriction_time) - time()  # Calculate time left for restriction to expire
+        if time_left <= 0:  # If time left is negative, remove restriction
+            del context.user_data["restrictSince"]
+            del context.user_data["usageCount"]
+            await update.message.reply_text(message_text(
+                language_code=context.user_data["language"],
+                message=tenant.messages["restriction_end_message"]
+            )) 
+        else:
+            await update.message.reply_text(message_text(
+                language_code=context.user_data["language"],
+                message=tenant.messages["restriction_message"]
+            )) 
+            return False
+    else:
+        if count >= tenant.max_usage:
+            context.user_data["restrictSince"] = time()
+            await update.message.reply_text(message_text(
+                language_code=context.user_data["language"],
+                message=tenant.messages["restriction_message"]
+            )) 
+            return False
+        else:
+            context.user_data["usageCount"] = count + 1
+    return True
+
+def record_message_count(update: Update, context: CallbackContext) -> None:
+    """
+    Records the date of the user's message and increments the user's message count.
+    """
+    current_datetime = datetime.now()
+    start_date = current_datetime.strftime('%Y-%m-%d')
+    user_id = update.effective_user.id
+    
+    user_data = context.bot_data.setdefault("user_message_counts", {}).setdefault(user_id, {})
+    user_data.setdefault(start_date, 0)
+    user_data[start_date] += 1
+
+@profiler.trace
 async def handle_message(update: Update, context: CallbackContext) -> None:
     """
     Handles incoming messages from users.
-    Processes user messages using MistralAI.
+    Processes user messages with the text generation backends.
     Updates messages with processed text.
     Records user message counts.
     """
     try:
         if not context.user_data.get("language"):
             await update.message.reply_text(message_text(
-                language_code=context.user_data.get("language", update.effective_user.language_code if update.effective_user.language_code in SUPPORTED_LANGUAGES else "en"),
-                message=skipped_start_command
+                language_code=context.tenant.user_language(update.effective_user),
+                message=context.tenant.messages["skipped_start_command"]
             ))
             return
-        # Import necessary modules for message processing
-        count = context.user_data.get("usageCount", 0) 
-        restrict_since = context.user_data.get("restrictSince", 0)
-        if restrict_since:
-            time_left = (restrict_since + 60 * 5) - time()  # Calculate time left for restriction to expire
-            if time_left <= 0:  # If time left is negative, remove restriction
-                del context.user_data["restrictSince"]
-                del context.user_data["usageCount"]
-                await update.message.reply_text(message_text(
-                    language_code=context.user_data["language"],
-                    message=restriction_end_message
-                )) 
-            else:
-                await update.message.reply_text(message_text(
-                    language_code=context.user_data["language"],
-                    message=restriction_message
-                )) 
-                raise ApplicationHandlerStop
-        else:
-            if count == MAX_USAGE:
-                context.user_data["restrictSince"] = time()
-                await update.message.reply_text(message_text(
-                    language_code=context.user_data["language"],
-                    message=restriction_message
-                )) 
-                raise ApplicationHandlerStop
-            else:
-                context.user_data["usageCount"] = count + 1
-                # Import necessary modules for message processing
-        from mistralai.async_client import MistralAsyncClient
-        from mistralai.models.chat_completion import ChatMessage
-
-        # Initialize MistralAsyncClient with the provided API key
-        client = MistralAsyncClient(api_key=api_key)
-
-        # Initialize an empty string to hold the edited text
-        edited_text = ""
-
-        # Send initial response indicating processing is underway
+        # Check the rate limit of the user
+        with profiler.span("rate_check"):
+            if not await check_usage(update, context):
+                return
+        await generate_reply(update, context, update.message.text)
+    except Exception as e:
+        await handle_error(update, context, f"Error handling message: {e}", reply=False)
+    finally:
+        context.tenant.update_log.finish(update)
+
+async def generate_reply(update: Update, context: CallbackContext, user_text: str) -> None:
+    """
+    Answers `user_text` (a text message or a voice transcript) with the text generation backends,
+    streaming the answer into a reply to the message of `update`.
+    """
+    # Compact the input and bound it to the token budget of the models
+    with profiler.span("prompt_prepare"):
+        prompt, tokens = prepare_prompt(user_text, prompt_budget)
+    # Texts over the budget are summarized in chunks instead of being sent in one piece
+    if tokens > prompt_budget:
+        await summarize_and_reply(update, context, split_chunks([prompt], summary_chunk_tokens))
+        return
+
+    # Send initial response indicating processing is underway
+    with profiler.span("placeholder_send"):
         text = await update.message.reply_text("🤖💬...")
+    reply = StreamRenderer(text)
+    context.tenant.update_log.track_reply(update, reply)
+
+    # Prepare the user's message for processing
+    messages = [{"role": "user", "content": prompt}]
+    stream_started = perf_counter()
+
+    # Iterate over the parts received from the backend
+    first_token = True
+    async for content in backend_pool.stream(messages, context.tenant.name):
+        if first_token:
+            profiler.mark("first_token", stream_started)
+            first_token = False
+        # Edits the active message, long replies continue in new messages
+        await reply.append(content)
+    
+    # Record the date of the user's message and increment the user's message count
+    with profiler.span("stats_update"):
+        record_message_count(update, context)
+    
+    # Send the remaining text
+    await reply.finish()
 
-        # Prepare the user's message for processing by Mistral
-        messages = [ChatMessage(role="user", content=update.message.text)]
 
-        # Start the async chat stream with Mistral
-        async_response = client.chat_stream(model=model, messages=messages)
+async def handle_message_wrapper(update: Update, context: CallbackContext) -> None:
+    """
+    Wraps the handle_message function in an asynchronous task for execution.
+    """
+    context.tenant.update_log.defer(update)
+    generations.spawn(handle_message(update, context))
 
-        # Iterate over the parts received from Mistral
-        async for chunk in async_response:
-            # Extract content from the chunk
-            content = chunk.choices[0].delta.content 
 
-            # Check if content is not empty
-            if content:
-                edited_text += content
+async def summarize_and_reply(update: Update, context: CallbackContext, chunks: list) -> None:
+    """
+    Summarizes the text chunks in parallel on the backend pool and streams the
+    merged summary, showing the progress in the reply.
+    """
+    tenant = context.tenant
+    language = context.user_data["language"]
+    if not chunks:
+        await update.message.reply_text(message_text(language, tenant.messages["empty_document"]))
+        return
+    text = await update.message.reply_text("🤖💬...")
+    reply = StreamRenderer(text)
+    context.tenant.update_log.track_reply(update, reply)
 
-                # Update the message with the edited text in chunks of 50 characters
-                if len(edited_text) % 50 == 0:
-                    await text.edit_text(edited_text)
-        
-        # Record the date of the user's message and increment the user's message count
-        current_datetime = datetime.now()
-        start_date = current_datetime.strftime('%Y-%m-%d')
-        user_id = update.effective_user.id
-        
-        user_data = context.bot_data.setdefault("user_message_counts", {}).setdefault(user_id, {})
-        user_data.setdefault(start_date, 0)
-        user_data[start_date] += 1
-        
-        # If there's any remaining edited text, update the message
-        if edited_text:
-            await text.edit_text(edited_text)
+    last_progress = 0.0
+
+    async def show_progress(done: int, total: int) -> None:
+        # Best-effort and coalesced, a failed or skipped progress edit never aborts the summary
+        nonlocal last_progress
+        if monotonic() - last_progress < PROGRESS_INTERVAL:
+            return
+        last_progress = monotonic()
+        try:
+            await text.edit_text(message_text(language, tenant.messages["summary_progress"], context={"done": done, "total": total}))
+        except Exception as e:
+            logger.warning(f"Error showing the summary progress: {e}")
+
+    async for content in summarize(chunks, backend_pool, tenant.messages["lang_config"][language], show_progress, tenant.name, summary_chunk_tokens):
+        await reply.append(content)
+    record_message_count(update, context)
+    await reply.finish()
+
+@profiler.trace
+async def handle_document(update: Update, context: CallbackContext) -> None:
+    """
+    Summarizes uploaded TXT, PDF and DOCX documents.
+    """
+    try:
+        if not context.user_data.get("language"):
+            await update.message.reply_text(message_text(
+                language_code=context.tenant.user_language(update.effective_user),
+                message=context.tenant.messages["skipped_start_command"]
+            ))
+            return
+        document = update.message.document
+        if not (document.file_name or "").lower().endswith(SUPPORTED_EXTENSIONS):
+            await update.message.reply_text(message_text(context.user_data["language"], context.tenant.messages["unsupported_document"]))
+            return
+        if not await check_usage(update, context):
+            return
+        file = await document.get_file()
+        buffer = BytesIO()
+        await file.download_to_memory(buffer)
+        buffer.seek(0)
+        # Extract and chunk the text in a thread, PDF parsing would block the event loop
+        chunks = await asyncio.to_thread(split_chunks, extract_text(buffer, document.file_name), summary_chunk_tokens)
+        await summarize_and_reply(update, context, chunks)
+    except UnsupportedDocument as e:
+        await update.message.reply_text(message_text(context.user_data["language"], context.tenant.messages["unsupported_document"]))
+        logger.warning(f"Unsupported document: {e}")
     except Exception as e:
-        await handle_error(update, context, f"Error handling message: {e}", reply=False)
+        await handle_error(update, context, f"Error handling document: {e}")
+    finally:
+        context.tenant.update_log.finish(update)
 
 
-async def handle_message_wrapper(update: Update, context: CallbackContext) -> None:
+async def handle_document_wrapper(update: Update, context: CallbackContext) -> None:
     """
-    Wraps the handle_message function in an asynchronous task for execution.
+    Wraps the handle_document function in an asynchronous task for execution.
     """
-    asyncio.create_task(handle_message(update, context))
+    context.tenant.update_log.defer(update)
+    generations.spawn(handle_document(update, context))
+
+
+@profiler.trace
+async def handle_voice(update: Update, context: CallbackContext) -> None:
+    """
+    Transcribes voice messages in the transcription worker processes and answers the
+    transcript like a text message.
+    """
+    tenant = context.tenant
+    try:
+        if not context.user_data.get("language"):
+            await update.message.reply_text(message_text(
+                language_code=tenant.user_language(update.effective_user),
+                message=tenant.messages["skipped_start_command"]
+            ))
+            return
+        language = context.user_data["language"]
+        voice = update.message.voice
+        if voice.duration > MAX_VOICE_DURATION:
+            await update.message.reply_text(message_text(language, tenant.messages["voice_too_long"], context={"max_minutes": MAX_VOICE_DURATION // 60}))
+            return
+        if not await check_usage(update, context):
+            return
+        # Forwarded voice notes are not downloaded again
+        transcript = transcriber.cached(voice.file_unique_id)
+        if transcript is None:
+            with profiler.span("voice_download"):
+                file = await voice.get_file()
+                data = await file.download_as_bytearray()
+            with profiler.span("transcribe"):
+                transcript = await transcriber.transcribe(voice.file_unique_id, bytes(data))
+        if not transcript.strip():
+            await update.message.reply_text(message_text(language, tenant.messages["voice_not_recognized"]))
+            return
+        await generate_reply(update, context, transcript)
+    except TranscriberBusy as e:
+        await update.message.reply_text(message_text(context.user_data["language"], tenant.messages["voice_busy"]))
+        logger.warning(f"Voice message rejected: {e}")
+    except Exception as e:
+        await handle_error(update, context, f"Error handling voice message: {e}")
+    finally:
+        tenant.update_log.finish(update)
+
+
+async def handle_voice_wrapper(update: Update, context: CallbackContext) -> None:
+    """
+    Wraps the handle_voice function in an asynchronous task for execution.
+    """
+    context.tenant.update_log.defer(update)
+    generations.spawn(handle_voice(update, context))
 
 
 async def handle_photo_messages(update: Update, context: CallbackContext) -> None:
     try:
         if not context.user_data.get("language"):
             await update.message.reply_text(message_text(
-                language_code=context.user_data.get("language", update.effective_user.language_code if update.effective_user.language_code in SUPPORTED_LANGUAGES else "en"),
-                message=skipped_start_command
+                language_code=context.tenant.user_language(update.effective_user),
+                message=context.tenant.messages["skipped_start_command"]
             ))
             return
         
-        photo_file = await update.message.photo[-1].get_file()
-        photo_bytes = BytesIO(await photo_file.download_as_bytearray())
+        # The update is finished by describe_photos
+        context.tenant.update_log.defer(update)
+        # Photos of an album are collected and described together
+        if update.message.media_group_id:
+            media_groups.add(update, context)
+            return
+        generations.spawn(describe_photos([update], context))
+    except Exception as e:
+        await handle_error(update, context, f"Error handling feedback: {e}")
+
+async def describe_photos(updates: list, context: CallbackContext) -> None:
+    """
+    Describes a single photo or a whole album with one llava request.
+    Downloads the photos concurrently and streams the reply to the first message.
+    """
+    update = updates[0]
+    try:
+        photo_files = await asyncio.gather(*(u.message.photo[-1].get_file() for u in updates))
+        photos = await asyncio.gather(*(photo_file.download_as_bytearray() for photo_file in photo_files))
         message = {
             'role': 'user',
-            'content': 'Describe this image:',
-            'images': [photo_bytes]
+            'content': 'Describe this image:' if len(photos) == 1 else 'Describe these images:',
+            'images': [bytes(photo) for photo in photos]
         }
         # Send the initial text
         text = await update.message.reply_text("...")
-        edited_text = ""
+        reply = StreamRenderer(text, edit_every=10)
+        context.tenant.update_log.track_reply(update, reply)
         # Send photo message to ollama for processing
-        for part in ollama.chat(model="llava", messages=[message], stream=True):
-            edited_text += part['message']['content']
+        from ollama import AsyncClient
+
+        warmer.touch(vision_model)
+        async for part in await AsyncClient().chat(model=vision_model, messages=[message], stream=True, keep_alive=warmer.keep_alive(vision_model)):
             # Edit the text with the combined content
-            if len(edited_text) % 10 == 0:
-                await text.edit_text(edited_text)
-        if edited_text:  # If there's any remaining text
-            await text.edit_text(edited_text)
+            await reply.append(part['message']['content'])
+        # Send the remaining text
+        await reply.finish()
     except Exception as e:
-        await handle_error(update, context, f"Error handling feedback: {e}")
+        await handle_error(update, context, f"Error describing photos: {e}")
+    finally:
+        for album_update in updates:
+            context.tenant.update_log.finish(album_update)
+
+# Collects the photos of an album so they are described in one request
+media_groups = MediaGroupCollector(describe_photos, spawn=generations.spawn)
 
 async def get_number_of_users(update: Update, context: CallbackContext):
     try:
@@ -376,7 +576,7 @@ async def get_number_of_users(update: Update, context: CallbackContext):
         current_date = datetime.now().strftime('%Y-%m-%d')
         
         # Get the number of total users
-        total_users = len(context.bot_data.get("user_ids", {}).keys())
+        total_users = context.tenant.sessions.count()
         
         # Get the total number of messages handled today
         total_messages_today = sum(user_count.get(current_date, 0) for user_count in context.bot_data.get("user_message_counts", {}).values())
@@ -412,7 +612,7 @@ async def export_data(update: Update, context: CallbackContext) -> None:
     try:
         # Prepare data for export
         bot_data = context.bot_data
-        user_data = context.user_data
+        user_data = context.user_data.to_dict()
         
         # Serialize bot data and user data to JSON
         bot_data_json = json.dumps(bot_data, indent=4)
@@ -438,9 +638,80 @@ async def export_data(update: Update, context: CallbackContext) -> None:
     except Exception as e:
         await update.message.reply_text("Error exporting data: {}".format(e))
 
-def main() -> None:
+async def admin_profile(update: Update, context: CallbackContext) -> None:
+    """
+    Command handler for /admin_profile <seconds> and /admin_profile stop.
+    Profiles the bot for the given number of seconds and sends the folded stacks
+    (flamegraph.pl / speedscope compatible) of the sampled event loop and of the handler spans.
+    """
+    try:
+        if context.args and context.args[0] == "stop":
+            profiler.request_stop()
+            return
+        if profiler.active:
+            await update.message.reply_text("Profiling is already running, use /admin_profile stop")
+            return
+        duration = float(context.args[0]) if context.args else 10
+        await update.message.reply_text(f"Profiling for {duration:g} seconds...")
+        # Run the session in the background so updates keep being processed
+        generations.spawn(send_profile(update, duration))
+    except Exception as e:
+        await update.message.reply_text(str(e))
+
+async def send_profile(update: Update, duration: float) -> None:
+    samples, spans = await profiler.run_session(duration)
+    await update.message.reply_document(BytesIO(samples.encode()), filename="profile_samples.folded")
+    if spans:
+        await update.message.reply_document(BytesIO(spans.encode()), filename="profile_spans.folded")
+    else:
+        await update.message.reply_text("No handler spans were recorded, set PROFILING=1 to instrument the handlers.")
+
+async def show_metrics(update: Update, context: CallbackContext) -> None:
+    """
+    Shows the bot metrics, including the readiness of the backends.
+    """
+    try:
+        status = "ready" if warmer.is_ready() else "warming up"
+        await update.message.reply_text(f"Backends: {status}\n{metrics.render()}")
+    except Exception as e:
+        await update.message.reply_text(str(e))
+
+def build_application(tenant: Tenant = None, base_url: str = None) -> Application:
+    """
+    Creates the Application of `tenant` (the bot configured in the environment by default) and registers all handlers.
+    `base_url` points the bot at another Bot API server (e.g. the stand-in server of replay.py).
+    """
+    tenant = tenant or tenant_from_env()
+    backend_pool.weights[tenant.name] = tenant.weight
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(TOKEN).build()
+    # Updates are only fetched once post_init has warmed the models
+    builder = (
+        Application.builder()
+        .application_class(TenantApplication, kwargs={"tenant": tenant})
+        .token(tenant.token)
+        .context_types(ContextTypes(context=SessionContext))
+        .request(bot_api_request)
+        .get_updates_request(request_from_env("get_updates", "TELEGRAM_UPDATES", pool_size=2, timeout=10))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if tenant.persistence_path:
+        # User data lives in the session store
+        builder.persistence(PicklePersistence(
+            tenant.persistence_path, store_data=PersistenceInput(user_data=False, chat_data=False, callback_data=False)
+        ))
+    if base_url:
+        builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
+
+    # Record incoming updates before any other handler sees them
+    if recorder:
+        application.add_handler(TypeHandler(Update, recorder.record), group=-2)
+
+    # Skip updates that were already processed before a restart
+    application.add_handler(TypeHandler(Update, tenant.update_log.check), group=-1)
+    application.add_handler(TypeHandler(Update, tenant.update_log.complete), group=1)
 
     # Add a handler for the /start command to greet new users when they first start using the bot
     # Ask the user to select a language
@@ -454,6 +725,12 @@ def main() -> None:
 
     # Add a handler for messages
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message_wrapper))
+
+    # Add a handler for documents to summarize
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_document_wrapper))
+
+    # Add a handler for voice messages, transcribed and answered like text
+    application.add_handler(MessageHandler(filters.VOICE, handle_voice_wrapper))
     application.add_handler(MessageHandler(filters.ALL & (~filters.PHOTO) & (~filters.TEXT | filters.COMMAND), start_private_chat))
 
     # Add a handler for photo messages
@@ -467,14 +744,129 @@ def main() -> None:
     # 1. /admin - Get the number of users in the chat with the bot and the total number of messages handled today
     # 2. /admin_export_data - Export the data of the bot to a JSON file
     # 3. /show_chats - Show which chats the bot is in and how many users are in each
-    application.add_handler(CommandHandler(command="admin",filters=filters.User(int(ADMIN_ID)), callback=get_number_of_users))
-    application.add_handler(CommandHandler(command="admin_export_data",filters=filters.User(int(ADMIN_ID)), callback=export_data))
-    application.add_handler(CommandHandler("show_chats", show_chats,filters=filters.User(int(ADMIN_ID))))
-
-    # Run the bot until the user presses Ctrl-C
-    # We pass 'allowed_updates' handle *all* updates including `chat_member` updates
-    # To reset this, simply pass `allowed_updates=[]`
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # 4. /admin_metrics - Show the bot metrics and the readiness of the backends
+    # 5. /admin_profile <seconds>|stop - Profile the bot and send the flamegraph stacks
+    application.add_handler(CommandHandler(command="admin",filters=filters.User(tenant.admin_id), callback=get_number_of_users))
+    application.add_handler(CommandHandler(command="admin_export_data",filters=filters.User(tenant.admin_id), callback=export_data))
+    application.add_handler(CommandHandler(command="admin_metrics",filters=filters.User(tenant.admin_id), callback=show_metrics))
+    application.add_handler(CommandHandler(command="admin_profile",filters=filters.User(tenant.admin_id), callback=admin_profile))
+    application.add_handler(CommandHandler("show_chats", show_chats,filters=filters.User(tenant.admin_id)))
+
+    # Wrap every handler registered above with timing spans
+    if PROFILING_ENABLED:
+        profiler.instrument(application)
+    return application
+
+async def post_init(application: Application) -> None:
+    """
+    Application post_init hook. Imports the backend clients, warms the models and schedules the housekeeping jobs.
+    """
+    # Polling starts after this awaited pre-import; running it in a thread keeps the slow client
+    # imports off the event loop and out of the first request that needs them
+    await asyncio.to_thread(import_backend_modules, backends, ["ollama"])
+    await warmer.post_init(application)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(evict_sessions, interval=300, first=300, name="evict_sessions")
+        application.job_queue.run_repeating(prune_message_counts, interval=3600, first=60, name="prune_message_counts")
+        application.job_queue.run_repeating(application.tenant.update_log.flush, interval=5, first=5, name="flush_update_log")
+        application.job_queue.run_once(application.tenant.update_log.expire_stale, STALE_UPDATE_WINDOW, name="expire_stale_updates")
+    if startup.PROFILE_STARTUP:
+        logger.info(startup.report("Ready to poll"))
+        startup.stop()
+
+async def evict_sessions(context: CallbackContext) -> None:
+    """
+    Pages idle user sessions out to disk and persists the modified ones.
+    """
+    context.tenant.sessions.evict_idle()
+    context.tenant.sessions.flush()
+
+async def prune_message_counts(context: CallbackContext) -> None:
+    """
+    Drops message counts older than STATS_RETENTION_DAYS and users without recent messages.
+    """
+    oldest_date = (datetime.now() - timedelta(days=STATS_RETENTION_DAYS)).strftime('%Y-%m-%d')
+    message_counts = context.bot_data.get("user_message_counts", {})
+    for user_id in list(message_counts):
+        counts = message_counts[user_id]
+        for date in [date for date in counts if date < oldest_date]:
+            del counts[date]
+        if not counts:
+            del message_counts[user_id]
+
+async def post_stop(application: Application) -> None:
+    """
+    Application post_stop hook. Polling has stopped, lets the running generations
+    finish within DRAIN_GRACE_PERIOD and marks the rest as interrupted.
+    The persistence is flushed afterwards by Application.shutdown.
+    """
+    # The generations are shared by all tenants, draining again after the first tenant is a no-op
+    await generations.drain()
+    await application.tenant.update_log.flush()
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Application post_shutdown hook. Persists the user sessions and the update log of the tenant
+    and stops the transcription workers (shared, stopping them again is a no-op).
+    """
+    application.tenant.sessions.close()
+    await application.tenant.update_log.flush()
+    await transcriber.shutdown()
+
+async def run_applications(applications: list) -> None:
+    """
+    Runs the applications of several tenants on one event loop until SIGINT or SIGTERM,
+    with the same lifecycle as Application.run_polling. All bots stop polling before the
+    shared generations are drained.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stop.set)
+    initialized = []
+    try:
+        for application in applications:
+            await application.initialize()
+            initialized.append(application)
+            await application.post_init(application)
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await application.start()
+            logger.info("Started @%s for tenant %s", application.bot.username, application.tenant.name)
+        await stop.wait()
+    finally:
+        for application in initialized:
+            if application.updater.running:
+                await application.updater.stop()
+        for application in initialized:
+            if application.running:
+                await application.stop()
+                await application.post_stop(application)
+        for application in initialized:
+            await application.shutdown()
+            await application.post_shutdown(application)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the Briefify bot.")
+    parser.add_argument("--profile-startup", action="store_true", help="log the startup time and the slowest imports")
+    parser.add_argument("--tenants", default=TENANTS_CONFIG, help="JSON file listing several bots to serve, see tenants.py")
+    args = parser.parse_args()
+
+    tenants = load_tenants(args.tenants) if args.tenants else [tenant_from_env()]
+    applications = [build_application(tenant) for tenant in tenants]
+    if startup.PROFILE_STARTUP:
+        logger.info(startup.report("Application built"))
+
+    try:
+        if len(applications) == 1:
+            # Run the bot until the user presses Ctrl-C
+            # We pass 'allowed_updates' handle *all* updates including `chat_member` updates
+            # To reset this, simply pass `allowed_updates=[]`
+            applications[0].run_polling(allowed_updates=Update.ALL_TYPES)
+        else:
+            asyncio.run(run_applications(applications))
+    finally:
+        if recorder:
+            recorder.close()
 
 
 # Run the bot in the main function
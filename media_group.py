@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+import metrics
+
+# How long to wait for the next photo of an album before processing it (seconds)
+MEDIA_GROUP_WINDOW = float(os.environ.get("MEDIA_GROUP_WINDOW", 1.0))
+# Telegram albums hold at most 10 items, a full album is processed right away
+MAX_MEDIA_GROUP_SIZE = 10
+
+
+class MediaGroupCollector:
+    """
+    Buffers the updates of an album (updates to one bot sharing a media_group_id) and hands
+    them to `callback(updates, context)` as one batch once no new item arrived
+    for MEDIA_GROUP_WINDOW seconds. The callback runs in a task started by `spawn`
+    (Application.create_task by default).
+    Albums are kept apart per bot, the collector may be shared by the applications of several tenants.
+    """
+
+    def __init__(self, callback, window: float = MEDIA_GROUP_WINDOW, spawn=None):
+        self.callback = callback
+        self.window = window
+        self.spawn = spawn
+        self.groups = {}
+
+    def add(self, update, context) -> None:
+        """Adds an album item and (re)starts the flush timer of its group."""
+        # Every bot in a chat receives the album with the same media_group_id
+        group_id = (context.bot.id, update.message.media_group_id)
+        group = self.groups.setdefault(group_id, {"updates": [], "timer": None})
+        group["updates"].append(update)
+        if group["timer"] is not None:
+            group["timer"].cancel()
+        if len(group["updates"]) >= MAX_MEDIA_GROUP_SIZE:
+            self._flush(group_id, context)
+        else:
+            group["timer"] = asyncio.get_running_loop().call_later(self.window, self._flush, group_id, context)
+
+    def _flush(self, group_id, context) -> None:
+        group = self.groups.pop(group_id, None)
+        if group is None:
+            return
+        updates = sorted(group["updates"], key=lambda u: u.message.message_id)
+        metrics.inc("media_groups")
+        metrics.inc("media_group_items", len(updates))
+        spawn = self.spawn or context.application.create_task
+        spawn(self.callback(updates, context))
@@ -0,0 +1,48 @@
+from time import time
+
+# In-process metrics shared by the bot components.
+# Everything runs on the asyncio event loop, so plain dicts are enough.
+_counters = {}
+_gauges = {}
+_timings = {}
+_started_at = time()
+
+def inc(name: str, value: int = 1) -> None:
+    """Increments the counter `name` by `value`."""
+    _counters[name] = _counters.get(name, 0) + value
+
+def set_gauge(name: str, value) -> None:
+    """Sets the gauge `name` to `value`."""
+    _gauges[name] = value
+
+def get_gauge(name: str, default=None):
+    return _gauges.get(name, default)
+
+def observe(name: str, value: float) -> None:
+    """Records one observation (e.g. a latency in seconds) for `name`."""
+    stats = _timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+    stats["count"] += 1
+    stats["sum"] += value
+    stats["max"] = max(stats["max"], value)
+
+def snapshot() -> dict:
+    """Returns a copy of all metrics, suitable for JSON serialization."""
+    return {
+        "uptime": round(time() - _started_at, 1),
+        "counters": dict(_counters),
+        "gauges": dict(_gauges),
+        "timings": {name: dict(stats) for name, stats in _timings.items()},
+    }
+
+def render() -> str:
+    """Renders all metrics as plain text, one metric per line."""
+    lines = [f"uptime: {time() - _started_at:.0f}s"]
+    for name in sorted(_counters):
+        lines.append(f"{name}: {_counters[name]}")
+    for name in sorted(_gauges):
+        lines.append(f"{name}: {_gauges[name]}")
+    for name in sorted(_timings):
+        stats = _timings[name]
+        avg = stats["sum"] / stats["count"] if stats["count"] else 0.0
+        lines.append(f"{name}: n={stats['count']} avg={avg:.3f}s max={stats['max']:.3f}s")
+    return "\n".join(lines)
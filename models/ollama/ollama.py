@@ -31,6 +31,9 @@ from bot_conv import *
 from datetime import datetime
 import json
 from ollama import AsyncClient
+import metrics
+from warmup import ModelWarmer
+from media_group import MediaGroupCollector
 
 # Enable logging
 logging.basicConfig(
@@ -47,6 +50,13 @@ SUPPORTED_LANGUAGES = ['en', 'ru', 'fr']
 GITHUB_REPO = "https://github.com/RusaUB/BriefifyBot"
 ADMIN_ID = os.environ.get("TELEGRAM_ADMIN_ID")
 
+# Ollama models
+text_model = "openhermes"
+vision_model = "llava"
+
+# Preloads the models and keeps them warm
+warmer = ModelWarmer([text_model, vision_model])
+
 
 async def handle_error(update, context, error_message, reply = True):
     """
@@ -261,7 +271,8 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
         message = {'role': 'user', 'content': update.message.text}
 
         # Iterate over the parts received from Mistral
-        async for part in await AsyncClient().chat(model='openhermes', messages=[message], stream=True):
+        warmer.touch(text_model)
+        async for part in await AsyncClient().chat(model=text_model, messages=[message], stream=True, keep_alive=warmer.keep_alive(text_model)):
             # Extract content from the chunk
             content = part['message']['content']
 
@@ -305,18 +316,34 @@ async def handle_photo_messages(update: Update, context: CallbackContext) -> Non
             ))
             return
         
-        photo_file = await update.message.photo[-1].get_file()
-        photo_bytes = BytesIO(await photo_file.download_as_bytearray())
+        # Photos of an album are collected and described together
+        if update.message.media_group_id:
+            media_groups.add(update, context)
+            return
+        await describe_photos([update], context)
+    except Exception as e:
+        await handle_error(update, context, f"Error handling feedback: {e}")
+
+async def describe_photos(updates: list, context: CallbackContext) -> None:
+    """
+    Describes a single photo or a whole album with one llava request.
+    Downloads the photos concurrently and streams the reply to the first message.
+    """
+    update = updates[0]
+    try:
+        photo_files = await asyncio.gather(*(u.message.photo[-1].get_file() for u in updates))
+        photos = await asyncio.gather(*(photo_file.download_as_bytearray() for photo_file in photo_files))
         message = {
             'role': 'user',
-            'content': 'Describe this image:',
-            'images': [photo_bytes]
+            'content': 'Describe this image:' if len(photos) == 1 else 'Describe these images:',
+            'images': [bytes(photo) for photo in photos]
         }
         # Send the initial text
         text = await update.message.reply_text("...")
         edited_text = ""
         # Send photo message to ollama for processing
-        for part in ollama.chat(model="llava", messages=[message], stream=True):
+        warmer.touch(vision_model)
+        async for part in await AsyncClient().chat(model=vision_model, messages=[message], stream=True, keep_alive=warmer.keep_alive(vision_model)):
             edited_text += part['message']['content']
             # Edit the text with the combined content
             if len(edited_text) % 10 == 0:
@@ -324,7 +351,10 @@ async def handle_photo_messages(update: Update, context: CallbackContext) -> Non
         if edited_text:  # If there's any remaining text
             await text.edit_text(edited_text)
     except Exception as e:
-        await handle_error(update, context, f"Error handling feedback: {e}")
+        await handle_error(update, context, f"Error describing photos: {e}")
+
+# Collects the photos of an album so they are described in one request
+media_groups = MediaGroupCollector(describe_photos)
 
 async def get_number_of_users(update: Update, context: CallbackContext):
     try:
@@ -394,9 +424,20 @@ async def export_data(update: Update, context: CallbackContext) -> None:
     except Exception as e:
         await update.message.reply_text("Error exporting data: {}".format(e))
 
+async def show_metrics(update: Update, context: CallbackContext) -> None:
+    """
+    Shows the bot metrics, including the readiness of the backends.
+    """
+    try:
+        status = "ready" if warmer.is_ready() else "warming up"
+        await update.message.reply_text(f"Backends: {status}\n{metrics.render()}")
+    except Exception as e:
+        await update.message.reply_text(str(e))
+
 def main() -> None:
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(TOKEN).build()
+    # Updates are only fetched once post_init has warmed the models
+    application = Application.builder().token(TOKEN).post_init(warmer.post_init).build()
 
     # Add a handler for the /start command to greet new users when they first start using the bot
     # Ask the user to select a language
@@ -412,8 +453,10 @@ def main() -> None:
     # 1. /admin - Get the number of users in the chat with the bot and the total number of messages handled today
     # 2. /admin_export_data - Export the data of the bot to a JSON file
     # 3. /show_chats - Show which chats the bot is in and how many users are in each
+    # 4. /admin_metrics - Show the bot metrics and the readiness of the backends
     application.add_handler(CommandHandler(command="admin",filters=filters.User(int(ADMIN_ID)), callback=get_number_of_users))
     application.add_handler(CommandHandler(command="admin_export_data",filters=filters.User(int(ADMIN_ID)), callback=export_data))
+    application.add_handler(CommandHandler(command="admin_metrics",filters=filters.User(int(ADMIN_ID)), callback=show_metrics))
     application.add_handler(CommandHandler("show_chats", show_chats,filters=filters.User(int(ADMIN_ID))))
 
     # Add a handler for messages
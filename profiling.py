@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+import metrics
+
+# Wrap the registered handlers with timing spans (opt-in, PROFILING=1)
+PROFILING_ENABLED = os.environ.get("PROFILING", "0") == "1"
+# Sampling interval of the stack sampler (seconds)
+SAMPLE_INTERVAL = float(os.environ.get("PROFILING_SAMPLE_INTERVAL", 0.005))
+# Upper bound for a single /admin_profile session (seconds)
+MAX_PROFILE_DURATION = 300
+
+# Handler/span path of the running task, e.g. ("handle_message_wrapper", "handle_message")
+_span_path = contextvars.ContextVar("span_path", default=())
+# Time spent in child spans of the running span, used to compute self time
+_child_time = contextvars.ContextVar("child_time", default=None)
+_null_span = nullcontext()
+
+
+class Profiler:
+    """
+    Records timing spans of the bot handlers and samples the event loop thread.
+    While no session is running `span` returns a shared no-op context manager and
+    wrapped handlers only pay one attribute lookup.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.record_metrics = False
+        self.spans = Counter()
+        self.samples = Counter()
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+        self._stop_requested = False
+
+    def trace(self, callback):
+        """Wraps a handler callback so it opens a span named after the callback."""
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            if not (self.active or self.record_metrics):
+                return await callback(*args, **kwargs)
+            with self._span(name):
+                return await callback(*args, **kwargs)
+        return wrapper
+
+    def instrument(self, application) -> None:
+        """Wraps the callback of every handler registered on `application`."""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                handler.callback = self.trace(handler.callback)
+
+    def span(self, name: str):
+        """Context manager timing one stage of a handler (no-op while profiling is off)."""
+        if not (self.active or self.record_metrics):
+            return _null_span
+        return self._span(name)
+
+    def mark(self, name: str, started: float) -> None:
+        """Records an instant stage (e.g. the first token) measured from `started` (perf_counter)."""
+        if self.active or self.record_metrics:
+            duration = perf_counter() - started
+            parent_time = _child_time.get()
+            if parent_time is not None:
+                parent_time[0] += duration
+            self._record(_span_path.get() + (name,), duration, duration)
+
+    @contextmanager
+    def _span(self, name: str):
+        path = _span_path.get() + (name,)
+        parent_time = _child_time.get()
+        children = [0.0]
+        path_token = _span_path.set(path)
+        time_token = _child_time.set(children)
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - started
+            _span_path.reset(path_token)
+            _child_time.reset(time_token)
+            if parent_time is not None:
+                parent_time[0] += duration
+            self._record(path, duration, max(duration - children[0], 0.0))
+
+    def _record(self, path: tuple, duration: float, self_time: float) -> None:
+        if self.active:
+            # Folded stacks hold the self time of each span in microseconds
+            self.spans[";".join(path)] += int(self_time * 1_000_000)
+        if self.record_metrics:
+            metrics.observe(f"span.{path[-1]}", duration)
+
+    def start(self) -> None:
+        """Starts a profiling session: span recording and stack sampling of the calling thread."""
+        if self.active:
+            return
+        self.spans.clear()
+        self.samples.clear()
+        self._stop_sampling.clear()
+        self._stop_requested = False
+        self.active = True
+        self._sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="profiler-sampler", daemon=True
+        )
+        self._sampler.start()
+
+    def stop(self) -> tuple:
+        """Stops the session and returns (samples, spans) in folded stack format."""
+        if not self.active:
+            return "", ""
+        self.active = False
+        self._stop_sampling.set()
+        self._sampler.join()
+        return _folded(self.samples), _folded(self.spans)
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stop_sampling.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def request_stop(self) -> None:
+        """Ends the running `run_session` early."""
+        self._stop_requested = True
+
+    async def run_session(self, duration: float) -> tuple:
+        """Profiles for `duration` seconds (or until `request_stop`) and returns the folded stacks."""
+        self.start()
+        deadline = perf_counter() + min(duration, MAX_PROFILE_DURATION)
+        while not self._stop_requested and perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        return self.stop()
+
+
+def _folded(counter: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in counter.most_common() if count)
+
+
+# Shared profiler used by the handlers
+profiler = Profiler()
@@ -0,0 +1,124 @@
+"""
+Prompt preparation before generation.
+User input is compacted (whitespace, repeated lines) and bounded to the token budget of
+the models, so the prefill cost of a request is predictable and never overflows the context.
+"""
+import os
+import re
+
+import metrics
+
+# Context size of the models in tokens, e.g. MODEL_CONTEXT_TOKENS="mistral-tiny=32000,openhermes=8192"
+DEFAULT_CONTEXT_TOKENS = int(os.environ.get("CONTEXT_TOKENS", 4096))
+RESERVED_OUTPUT_TOKENS = int(os.environ.get("RESERVED_OUTPUT_TOKENS", 1024)) # kept free for the answer
+# Max input tokens per request, longer inputs are summarized in chunks (or truncated)
+PROMPT_BUDGET_TOKENS = int(os.environ.get("PROMPT_BUDGET_TOKENS", os.environ.get("LONG_TEXT_TOKENS", 1500)))
+# What happens to inputs over the budget: "summarize" or "truncate"
+OVER_BUDGET = os.environ.get("OVER_BUDGET", "summarize")
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SPACES = re.compile(r"(?<=\S)[ \t]{2,}")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def _parse_models(spec: str) -> dict:
+    """Parses "model=tokens,model=tokens"."""
+    models = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, tokens = item.partition("=")
+        models[model] = int(tokens)
+    return models
+
+MODEL_CONTEXT_TOKENS = _parse_models(os.environ.get("MODEL_CONTEXT_TOKENS", ""))
+# Per-model override of PROMPT_BUDGET_TOKENS, same format
+MODEL_PROMPT_BUDGETS = _parse_models(os.environ.get("MODEL_PROMPT_BUDGETS", ""))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local estimate of the BPE token count: one token per 4 characters of Latin words,
+    per 2 characters of other scripts (Cyrillic, CJK) and one per punctuation mark.
+    """
+    return sum(_word_tokens(match.group()) for match in _TOKEN.finditer(text))
+
+def _word_tokens(word: str) -> int:
+    return (len(word) + 3) // 4 if word.isascii() else (len(word) + 1) // 2
+
+def prompt_budget(model: str) -> int:
+    """Returns the max input tokens of a request to `model`."""
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return min(MODEL_PROMPT_BUDGETS.get(model, PROMPT_BUDGET_TOKENS), context - RESERVED_OUTPUT_TOKENS)
+
+def pool_budget(backends: list) -> int:
+    """Returns the input budget that fits every backend, any of them may serve a request."""
+    return min(prompt_budget(backend.model) for backend in backends)
+
+def compact(text: str) -> str:
+    """
+    Removes what costs tokens without carrying meaning: trailing spaces, runs of spaces
+    inside lines, more than one blank line and consecutive repeated lines (pasted logs).
+    Leading indentation is kept.
+    """
+    lines = []
+    repeated = 0
+    for line in text.strip().splitlines() + [None]:
+        if line is not None:
+            line = _SPACES.sub(" ", line.rstrip())
+            if lines and line and line == lines[-1]:
+                repeated += 1
+                continue
+        # A single repetition is cheaper than the note
+        if repeated == 1:
+            lines.append(lines[-1])
+        elif repeated:
+            lines.append(f"(previous line repeated {repeated} more times)")
+        repeated = 0
+        if line is not None:
+            lines.append(line)
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines))
+
+def truncate(text: str, budget: int) -> str:
+    """Keeps the start and the end of `text` (two thirds and one third of `budget` tokens)."""
+    head_budget = budget * 2 // 3
+    tail_budget = budget - head_budget - estimate_tokens(TRUNCATION_MARKER)
+    matches = list(_TOKEN.finditer(text))
+    head_end = _cut(matches, head_budget)
+    tail_start = len(text) - _cut(reversed(matches), tail_budget, from_end=len(text))
+    if tail_start <= head_end:
+        return text
+    return text[:head_end] + TRUNCATION_MARKER + text[tail_start:]
+
+def fit_tokens(text: str, budget: int) -> int:
+    """Returns the length of the longest start of `text` within `budget` tokens, cut between tokens."""
+    return _cut(_TOKEN.finditer(text), budget)
+
+def _cut(matches, budget: int, from_end: int = None) -> int:
+    """Returns how many characters (from the start, or back from `from_end`) fit into `budget` tokens."""
+    tokens = 0
+    position = 0
+    for match in matches:
+        tokens += _word_tokens(match.group())
+        if tokens > budget:
+            break
+        position = match.end() if from_end is None else from_end - match.start()
+    return position
+
+def prepare_prompt(text: str, budget: int, over_budget: str = OVER_BUDGET) -> tuple:
+    """
+    Compacts `text` and bounds it to `budget` tokens.
+    Returns (text, tokens); with over_budget="summarize", inputs over the budget are returned
+    whole and the caller routes them to the chunked summarization.
+    """
+    compacted = compact(text)
+    tokens = estimate_tokens(compacted)
+    metrics.inc("prompt_tokens_compacted", estimate_tokens(text) - tokens)
+    if tokens > budget:
+        metrics.inc("prompts_over_budget")
+        if over_budget == "truncate":
+            compacted = truncate(compacted, budget)
+            tokens = estimate_tokens(compacted)
+    metrics.inc("prompts")
+    metrics.inc("prompt_tokens", tokens)
+    return compacted, tokens
@@ -0,0 +1,230 @@
+"""
+Replays an update trace recorded with TRACE_RECORD_PATH against local stand-in
+Telegram and LLM servers and reports per-handler throughput and latency.
+
+    python replay.py trace.jsonl.gz --speed 10
+
+--speed 1 replays in real time, 10 ten times faster and 0 as fast as possible.
+"""
+import argparse
+import asyncio
+import json
+import os
+from time import perf_counter, time
+from urllib.parse import parse_qs
+
+# The stand-in servers need no real credentials
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:replay")
+os.environ.setdefault("TELEGRAM_ADMIN_ID", "1")
+os.environ.setdefault("MISTRAL_API_KEY", "replay")
+# Keep the replayed users out of the production session store and update log, and the
+# replayed traffic out of any trace (possibly the one being replayed), even when they are configured
+os.environ["SESSION_DB_PATH"] = ":memory:"
+os.environ["UPDATE_LOG_PATH"] = ""
+os.environ.pop("TRACE_RECORD_PATH", None)
+
+# Connection handler tasks of the stand-in servers, not awaited when draining the bot
+server_tasks = set()
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Briefify", "username": "briefify_replay_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+async def read_request(reader):
+    """Reads one HTTP/1.1 request and returns (method, path, headers, body), or None on EOF."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode().split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, value = line.decode().split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, headers, body
+
+def write_response(writer, body: bytes, content_type: str = "application/json") -> None:
+    writer.write(
+        f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+
+async def write_chunked(writer, chunks, delay: float, first_delay: float, content_type: str) -> None:
+    """Streams `chunks` with chunked transfer encoding, waiting `delay` seconds between them."""
+    writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n\r\n".encode())
+    await asyncio.sleep(first_delay)
+    for chunk in chunks:
+        writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        await writer.drain()
+        await asyncio.sleep(delay)
+    writer.write(b"0\r\n\r\n")
+
+
+class StandInServer:
+    """Base class of the stand-in servers, serves one connection per `handle` call."""
+
+    async def handle(self, reader, writer) -> None:
+        server_tasks.add(asyncio.current_task())
+        try:
+            await self.serve(reader, writer)
+        except (asyncio.CancelledError, ConnectionError):
+            # The bot closed the connection or the replay is over
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, reader, writer) -> None:
+        raise NotImplementedError
+
+
+class StandInTelegram(StandInServer):
+    """Minimal Bot API server answering the methods used by the bot with plausible results."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.message_id = 0
+        self.calls = {}
+
+    async def serve(self, reader, writer) -> None:
+        while (request := await read_request(reader)) is not None:
+            _, path, headers, body = request
+            if path.startswith("/file/"):
+                write_response(writer, b"\xff\xd8replay", "image/jpeg")
+                await writer.drain()
+                continue
+            bot_method = path.rsplit("/", 1)[-1]
+            self.calls[bot_method] = self.calls.get(bot_method, 0) + 1
+            params = self.parse(headers, body)
+            await asyncio.sleep(self.latency)
+            write_response(writer, json.dumps({"ok": True, "result": self.result(bot_method, params)}).encode())
+            await writer.drain()
+
+    @staticmethod
+    def parse(headers: dict, body: bytes) -> dict:
+        content_type = headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        return {}
+
+    def result(self, bot_method: str, params: dict):
+        if bot_method == "getMe":
+            return BOT_USER
+        if bot_method == "getFile":
+            return {"file_id": params.get("file_id", "replay"), "file_unique_id": "replay", "file_size": 8, "file_path": "photos/replay.jpg"}
+        if bot_method.startswith(("send", "edit")):
+            self.message_id += 1
+            chat_id = int(params.get("chat_id", 1))
+            return {
+                "message_id": int(params.get("message_id", self.message_id)),
+                "date": int(time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+class StandInLLM(StandInServer):
+    """Streams canned completions in the Ollama (/api/chat, /api/generate) and Mistral (/v1/chat/completions) formats."""
+
+    def __init__(self, tokens: int, token_delay: float, first_token_delay: float):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+
+    async def serve(self, reader, writer) -> None:
+        while (request := await read_request(reader)) is not None:
+            _, path, _, body = request
+            words = [f"word{i} " for i in range(self.tokens)]
+            if path.startswith("/api/generate") and not json.loads(body or b"{}").get("prompt"):
+                # Model warm-up
+                write_response(writer, json.dumps({"model": "replay", "created_at": "", "response": "", "done": True}).encode())
+            elif path.startswith("/api/"):
+                chunks = [json.dumps({"model": "replay", "created_at": "", "message": {"role": "assistant", "content": word}, "done": False}).encode() + b"\n" for word in words]
+                chunks.append(json.dumps({"model": "replay", "created_at": "", "message": {"role": "assistant", "content": ""}, "done": True}).encode() + b"\n")
+                await write_chunked(writer, chunks, self.token_delay, self.first_token_delay, "application/x-ndjson")
+            else:
+                chunks = [b"data: " + json.dumps({
+                    "id": "replay", "object": "chat.completion.chunk", "created": int(time()), "model": "replay",
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": word}, "finish_reason": None}],
+                }).encode() + b"\n\n" for word in words]
+                chunks.append(b"data: [DONE]\n\n")
+                await write_chunked(writer, chunks, self.token_delay, self.first_token_delay, "text/event-stream")
+            await writer.drain()
+
+
+async def replay(args) -> None:
+    telegram_server = StandInTelegram(args.telegram_latency)
+    llm_server = StandInLLM(args.tokens, args.token_delay, args.first_token_delay)
+    telegram = await asyncio.start_server(telegram_server.handle, "127.0.0.1", 0)
+    llm = await asyncio.start_server(llm_server.handle, "127.0.0.1", 0)
+    llm_url = f"http://127.0.0.1:{llm.sockets[0].getsockname()[1]}"
+    os.environ["OLLAMA_HOST"] = llm_url
+    os.environ["MISTRAL_ENDPOINT"] = llm_url
+
+    # Imported after the environment is set up
+    import metrics
+    from profiling import profiler
+    from update_trace import load_trace
+    from telegram import Update
+    import main as bot
+
+    application = bot.build_application(base_url=f"http://127.0.0.1:{telegram.sockets[0].getsockname()[1]}")
+    if not bot.PROFILING_ENABLED:
+        profiler.instrument(application)
+    profiler.record_metrics = True
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    background = asyncio.all_tasks()
+
+    count = 0
+    started = perf_counter()
+    trace_start = None
+    for timestamp, data in load_trace(args.trace):
+        if trace_start is None:
+            trace_start = timestamp
+        if args.speed > 0:
+            delay = (timestamp - trace_start) / args.speed - (perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        count += 1
+
+    # Wait for the queued updates and the generation tasks they started
+    while not application.update_queue.empty():
+        await asyncio.sleep(0.01)
+    while pending := asyncio.all_tasks() - background - server_tasks - {asyncio.current_task()}:
+        await asyncio.wait(pending)
+    elapsed = perf_counter() - started
+
+    await application.stop()
+    await application.shutdown()
+    telegram.close()
+    llm.close()
+
+    print(f"Replayed {count} updates in {elapsed:.2f}s ({count / elapsed:.1f} updates/s)")
+    print(f"{'handler/stage':<32}{'count':>8}{'per s':>10}{'avg ms':>10}{'max ms':>10}")
+    for name, stats in sorted(metrics.snapshot()["timings"].items()):
+        if name.startswith("span."):
+            avg = stats["sum"] / stats["count"] * 1000
+            print(f"{name[5:]:<32}{stats['count']:>8}{stats['count'] / elapsed:>10.1f}{avg:>10.1f}{stats['max'] * 1000:>10.1f}")
+    print("Bot API calls: " + ", ".join(f"{name}={calls}" for name, calls in sorted(telegram_server.calls.items())))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded update trace against stand-in servers.")
+    parser.add_argument("trace", help="trace file written with TRACE_RECORD_PATH")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed factor, 0 replays as fast as possible")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Bot API round-trip time in seconds")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per generated answer")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between generated tokens")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="seconds until the first token")
+    asyncio.run(replay(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
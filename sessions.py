@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import struct
+from collections import OrderedDict
+from time import time
+
+from telegram.ext import CallbackContext
+
+import metrics
+
+# Session store settings
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.sqlite3")
+MAX_RESIDENT_SESSIONS = int(os.environ.get("MAX_RESIDENT_SESSIONS", 10000)) # sessions kept in memory
+SESSION_IDLE_TIMEOUT = int(os.environ.get("SESSION_IDLE_TIMEOUT", 30 * 60)) # page out after 30 minutes
+
+# usage count, restricted since, started at; language and blocked have their own columns
+RECORD = struct.Struct("<Hdd")
+# Layout of the stores written before language and blocked moved out of the record
+_LEGACY_RECORD = struct.Struct("<4sHddB")
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, language TEXT NOT NULL,"
+    " blocked INTEGER NOT NULL, record BLOB NOT NULL)"
+)
+
+
+class UserSession:
+    """
+    Compact per-user record replacing the context.user_data dict.
+    Supports the dict operations the handlers use on the legacy keys
+    ("language", "usageCount", "restrictSince", "startedAt", "blocked"); unset fields behave like missing keys.
+    """
+
+    __slots__ = ("user_id", "language", "usage_count", "restrict_since", "started_at", "blocked", "last_seen", "dirty")
+
+    # legacy user_data key -> (attribute, unset value)
+    FIELDS = {
+        "language": ("language", ""),
+        "usageCount": ("usage_count", 0),
+        "restrictSince": ("restrict_since", 0.0),
+        "startedAt": ("started_at", 0.0),
+        "blocked": ("blocked", False),
+    }
+
+    def __init__(self, user_id: int, language: str = "", usage_count: int = 0,
+                 restrict_since: float = 0.0, started_at: float = 0.0, blocked: bool = False):
+        self.user_id = user_id
+        self.language = language
+        self.usage_count = usage_count
+        self.restrict_since = restrict_since
+        self.started_at = started_at
+        self.blocked = blocked
+        self.last_seen = time()
+        self.dirty = False
+
+    def get(self, key: str, default=None):
+        attribute, unset = self.FIELDS[key]
+        value = getattr(self, attribute)
+        return default if value == unset else value
+
+    def __getitem__(self, key: str):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value) -> None:
+        setattr(self, self.FIELDS[key][0], value)
+        self.dirty = True
+
+    def __delitem__(self, key: str) -> None:
+        self[key] = self.FIELDS[key][1]
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def to_dict(self) -> dict:
+        return {key: self.get(key) for key in self.FIELDS if key in self}
+
+    def pack(self) -> bytes:
+        return RECORD.pack(min(self.usage_count, 0xFFFF), self.restrict_since, self.started_at)
+
+    @classmethod
+    def unpack(cls, user_id: int, language: str, blocked: int, record: bytes) -> "UserSession":
+        usage_count, restrict_since, started_at = RECORD.unpack(record)
+        return cls(user_id, language, usage_count, restrict_since, started_at, bool(blocked))
+
+
+class SessionStore:
+    """
+    Keeps the sessions of recently active users in an LRU working set and pages
+    the others out to SQLite. Sessions are loaded lazily on the next update of their user.
+    The language (any length of code) and the blocked flag are columns, so they can be queried.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, max_resident: int = MAX_RESIDENT_SESSIONS):
+        self.db = sqlite3.connect(path)
+        self._migrate()
+        self.db.execute(_SCHEMA)
+        self.max_resident = max_resident
+        self.resident = OrderedDict()
+
+    def get(self, user_id: int) -> UserSession:
+        session = self.resident.get(user_id)
+        if session is None:
+            row = self.db.execute("SELECT language, blocked, record FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            session = UserSession.unpack(user_id, *row) if row else UserSession(user_id)
+            self.resident[user_id] = session
+            metrics.inc("session_loads" if row else "session_creates")
+            if len(self.resident) > self.max_resident:
+                self._page_out([self.resident.popitem(last=False)[1]])
+        else:
+            self.resident.move_to_end(user_id)
+        session.last_seen = time()
+        metrics.set_gauge("sessions_resident", len(self.resident))
+        return session
+
+    def evict_idle(self, idle_timeout: float = SESSION_IDLE_TIMEOUT) -> None:
+        """Pages out every session that was not used for `idle_timeout` seconds."""
+        deadline = time() - idle_timeout
+        idle = []
+        # The OrderedDict is in LRU order, the idle sessions are at the front
+        for session in self.resident.values():
+            if session.last_seen >= deadline:
+                break
+            idle.append(session)
+        for session in idle:
+            del self.resident[session.user_id]
+        self._page_out(idle)
+        metrics.set_gauge("sessions_resident", len(self.resident))
+
+    def flush(self) -> None:
+        """Writes all modified resident sessions to disk."""
+        self._write([session for session in self.resident.values() if session.dirty])
+
+    def count(self) -> int:
+        """Returns the number of users with a stored session who have not blocked the bot."""
+        self.flush()
+        return self.db.execute("SELECT COUNT(*) FROM sessions WHERE blocked = 0").fetchone()[0]
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+
+    def _migrate(self) -> None:
+        """Converts a store with the legacy record layout (language cut to 4 bytes, blocked in the record)."""
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(sessions)")]
+        if columns != ["user_id", "record"]:
+            return
+        rows = []
+        for user_id, record in self.db.execute("SELECT user_id, record FROM sessions"):
+            language, usage_count, restrict_since, started_at, blocked = _LEGACY_RECORD.unpack(record)
+            rows.append((user_id, language.rstrip(b"\0").decode(), blocked, RECORD.pack(usage_count, restrict_since, started_at)))
+        with self.db:
+            self.db.execute("DROP TABLE sessions")
+            self.db.execute(_SCHEMA)
+            self.db.executemany("INSERT INTO sessions VALUES (?, ?, ?, ?)", rows)
+
+    def _page_out(self, sessions: list) -> None:
+        self._write([session for session in sessions if session.dirty])
+        metrics.inc("session_page_outs", len(sessions))
+
+    def _write(self, sessions: list) -> None:
+        if not sessions:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sessions (user_id, language, blocked, record) VALUES (?, ?, ?, ?)",
+                [(session.user_id, session.language, int(session.blocked), session.pack()) for session in sessions],
+            )
+        for session in sessions:
+            session.dirty = False
+
+
+class SessionContext(CallbackContext):
+    """
+    CallbackContext of the bot's handlers and jobs.
+    Its user_data is the UserSession of the user from the session store of the tenant.
+    """
+
+    @property
+    def tenant(self):
+        """The Tenant (see tenants.py) whose bot received the update."""
+        return self.application.tenant
+
+    @property
+    def user_data(self):
+        if self._user_id is not None:
+            return self.tenant.sessions.get(self._user_id)
+        return None
@@ -0,0 +1,47 @@
+"""
+Startup profiling for `python main.py --profile-startup`.
+Must be imported before any other module of the bot, so the import hook sees every import.
+"""
+import builtins
+import sys
+import threading
+from time import perf_counter
+
+PROFILE_STARTUP = "--profile-startup" in sys.argv
+
+started = perf_counter()
+import_times = {}
+_state = threading.local()
+_original_import = builtins.__import__
+
+
+def _timed_import(name, *args, **kwargs):
+    # Already imported modules and nested imports are accounted to the outermost import
+    if name in sys.modules or getattr(_state, "depth", 0):
+        _state.depth = getattr(_state, "depth", 0) + 1
+        try:
+            return _original_import(name, *args, **kwargs)
+        finally:
+            _state.depth -= 1
+    _state.depth = 1
+    import_started = perf_counter()
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        _state.depth = 0
+        import_times[name] = import_times.get(name, 0.0) + perf_counter() - import_started
+
+def stop() -> None:
+    """Removes the import hook."""
+    builtins.__import__ = _original_import
+
+def report(stage: str, top: int = 15) -> str:
+    """Returns the time since startup and the slowest top-level imports."""
+    lines = [f"{stage} after {perf_counter() - started:.3f}s, imports took {sum(import_times.values()):.3f}s"]
+    for name, elapsed in sorted(import_times.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"  {elapsed * 1000:8.1f} ms  {name}")
+    return "\n".join(lines)
+
+
+if PROFILE_STARTUP:
+    builtins.__import__ = _timed_import
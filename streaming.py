@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+from time import monotonic
+
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter
+
+import metrics
+from lifecycle import generations
+from profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of new characters before the active message is edited again
+EDIT_EVERY = int(os.environ.get("STREAM_EDIT_EVERY", 50))
+# Minimum seconds between two edits of a streamed reply, Telegram throttles faster edits of one chat
+EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", 1.0))
+MAX_LENGTH = MessageLimit.MAX_TEXT_LENGTH
+# Preferred split points, from the best to the worst
+SEPARATORS = ("\n\n", "\n", ". ", "! ", "? ", " ")
+
+
+def find_split(text: str, limit: int = MAX_LENGTH) -> int:
+    """
+    Returns the index at which `text` is split so the first part fits into one message.
+    Prefers paragraph, then line, then sentence, then word boundaries in the second half of the page.
+    """
+    for separator in SEPARATORS:
+        index = text.rfind(separator, limit // 2, limit)
+        if index != -1:
+            return index + len(separator)
+    return limit
+
+
+class StreamRenderer:
+    """
+    Streams a reply into Telegram messages.
+    Only the active (last) message is edited; once it is full it is frozen at a
+    paragraph or sentence boundary and the reply continues in a new message.
+    Intermediate edits are throttled and best-effort; only the edits that freeze a page
+    or finish the reply must succeed.
+    """
+
+    def __init__(self, message, edit_every: int = EDIT_EVERY, edit_interval: float = EDIT_INTERVAL):
+        self.message = message
+        self.edit_every = edit_every
+        self.edit_interval = edit_interval
+        self.next_edit = 0.0
+        self.text = ""
+        self.sent_text = None
+        self.pages = 1
+        self.message_ids = [message.message_id]
+        # Finalized with an "(interrupted)" marker if the bot stops during the stream
+        generations.attach(self)
+
+    async def append(self, content: str) -> None:
+        self.text += content
+        while len(self.text) > MAX_LENGTH:
+            split = find_split(self.text)
+            page, self.text = self.text[:split].rstrip(), self.text[split:].lstrip()
+            await self._edit(page)
+            # Continue in a new message
+            self.message = await self.message.chat.send_message(self.text or "...")
+            self.sent_text = self.text or "..."
+            self.pages += 1
+            self.message_ids.append(self.message.message_id)
+        if len(self.text) - len(self.sent_text or "") >= self.edit_every and monotonic() >= self.next_edit:
+            await self._edit(self.text, final=False)
+
+    async def finish(self, suffix: str = "") -> None:
+        """Sends the remaining text of the active message, followed by `suffix`."""
+        text = self.text + suffix
+        if len(text) > MAX_LENGTH:
+            await self.append(suffix)
+            text = self.text
+        if text.strip():
+            await self._edit(text)
+
+    async def _edit(self, text: str, final: bool = True) -> None:
+        """Edits the active message. Failed intermediate edits are skipped, final ones wait out flood control."""
+        if text == self.sent_text or not text.strip():
+            return
+        with profiler.span("edit"):
+            try:
+                await self.message.edit_text(text)
+            except RetryAfter as e:
+                delay = _seconds(e.retry_after)
+                metrics.inc("stream_edits_throttled")
+                if not final:
+                    self.next_edit = monotonic() + delay
+                    return
+                await asyncio.sleep(delay)
+                await self.message.edit_text(text)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    if final:
+                        raise
+                    logger.warning(f"Skipped an intermediate edit: {e}")
+                    return
+        self.sent_text = text
+        self.next_edit = monotonic() + self.edit_interval
+
+
+def _seconds(retry_after) -> float:
+    """RetryAfter.retry_after is an int or a timedelta, depending on the library version."""
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
@@ -0,0 +1,169 @@
+import asyncio
+import codecs
+import logging
+import os
+import re
+import zipfile
+from io import BytesIO
+from xml.etree.ElementTree import iterparse
+
+from prompting import estimate_tokens, fit_tokens, truncate
+
+logger = logging.getLogger(__name__)
+
+# Summarization settings
+CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", 1500)) # max tokens per summarized chunk
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+SUMMARY_PROMPT = "Summarize the following text concisely. Answer in {language}.\n\n{text}"
+MERGE_PROMPT = "Combine these partial summaries of one document into a single coherent summary. Answer in {language}.\n\n{text}"
+
+_DOCX_PARAGRAPH = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}p"
+_DOCX_TEXT = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}t"
+
+
+class UnsupportedDocument(Exception):
+    pass
+
+
+def extract_text(file: BytesIO, filename: str):
+    """
+    Yields the text of a TXT, PDF or DOCX file piece by piece (lines, pages or paragraphs),
+    so large documents are chunked without holding all of their text at once.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".txt":
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while block := file.read(64 * 1024):
+            yield decoder.decode(block)
+        yield decoder.decode(b"", final=True)
+    elif extension == ".pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise UnsupportedDocument("PDF support requires the pypdf package")
+        for page in PdfReader(file).pages:
+            yield (page.extract_text() or "") + "\n\n"
+    elif extension == ".docx":
+        with zipfile.ZipFile(file) as archive, archive.open("word/document.xml") as document:
+            paragraph = []
+            for _, element in iterparse(document):
+                if element.tag == _DOCX_TEXT and element.text:
+                    paragraph.append(element.text)
+                elif element.tag == _DOCX_PARAGRAPH:
+                    yield "".join(paragraph) + "\n\n"
+                    paragraph = []
+                    element.clear()
+    else:
+        raise UnsupportedDocument(f"Unsupported file type: {extension or filename}")
+
+def chunk_budget(prompt_budget: int) -> int:
+    """
+    Returns the chunk size for requests of at most `prompt_budget` tokens, prompt included.
+    Raises ValueError when the budget leaves no room for a chunk.
+    """
+    max_tokens = min(CHUNK_TOKENS, prompt_budget - estimate_tokens(MERGE_PROMPT))
+    if max_tokens <= 0:
+        raise ValueError(
+            f"Prompt budget of {prompt_budget} tokens leaves no room for summary chunks, "
+            "raise CONTEXT_TOKENS or PROMPT_BUDGET_TOKENS, or lower RESERVED_OUTPUT_TOKENS"
+        )
+    return max_tokens
+
+def split_chunks(pieces, max_tokens: int = CHUNK_TOKENS) -> list:
+    """
+    Groups text pieces into chunks of at most `max_tokens` (see prompting.estimate_tokens),
+    splitting at paragraph or sentence boundaries.
+    """
+    if max_tokens <= 0:
+        raise ValueError(f"Chunks of {max_tokens} tokens hold no text")
+    chunks = []
+    current = ""
+    current_tokens = 0
+    for piece in pieces:
+        for part in re.split(r"(?<=\n\n)|(?<=[.!?] )", piece):
+            tokens = estimate_tokens(part)
+            if current_tokens + tokens > max_tokens and current:
+                chunks.append(current)
+                current = ""
+                current_tokens = 0
+            while tokens > max_tokens:
+                # A single sentence longer than a chunk, a single huge word is cut by characters
+                split = fit_tokens(part, max_tokens) or max_tokens * 2
+                chunks.append(part[:split])
+                part = part[split:]
+                tokens = estimate_tokens(part)
+            current += part
+            current_tokens += tokens
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+async def summarize(chunks: list, pool, language: str, on_progress=None, tenant: str = None, max_tokens: int = CHUNK_TOKENS):
+    """
+    Map-reduce summarization of `chunks` on the backend pool.
+    The chunks are summarized concurrently (up to the free slots of the pool), the partial
+    summaries are merged level by level, and the final summary is streamed back.
+    `on_progress(done, total)` is awaited whenever a partial summary is finished; its errors
+    are logged and never abort the summary.
+    The requests are queued as `tenant` on the pool, partial summaries are merged in groups of `max_tokens`.
+    """
+    if len(chunks) == 1:
+        async for content in pool.stream(_messages(SUMMARY_PROMPT, chunks[0], language), tenant):
+            yield content
+        return
+
+    done = 0
+    total = len(chunks)
+
+    async def summarize_part(prompt: str, text: str) -> str:
+        nonlocal done
+        summary = await pool.complete(_messages(prompt, text, language), tenant)
+        done += 1
+        if on_progress is not None:
+            try:
+                await on_progress(done, total)
+            except Exception as e:
+                logger.warning(f"Error reporting the summary progress: {e}")
+        return summary
+
+    summaries = await _gather(summarize_part(SUMMARY_PROMPT, chunk) for chunk in chunks)
+    # Merge the partial summaries until they fit into one request
+    condensed = False
+    while True:
+        groups = split_chunks((summary + "\n\n" for summary in summaries), max_tokens)
+        if len(groups) <= 1:
+            break
+        if len(groups) < len(summaries):
+            total += len(groups)
+            summaries = await _gather(summarize_part(MERGE_PROMPT, group) for group in groups)
+        elif not condensed:
+            # Summaries over half a group are never merged with another one, shorten each of them once
+            condensed = True
+            total += len(summaries)
+            summaries = await _gather(summarize_part(SUMMARY_PROMPT, summary) for summary in summaries)
+        else:
+            # Still too long, every summary gets an equal share of the final request
+            share = max(1, max_tokens // len(summaries))
+            summaries = [truncate(summary, share) for summary in summaries]
+            break
+    # The final request never exceeds the budget, whatever the backends answered
+    text = "\n\n".join(summaries)
+    if estimate_tokens(text) > max_tokens:
+        text = truncate(text, max_tokens)
+    async for content in pool.stream(_messages(MERGE_PROMPT, text, language), tenant):
+        yield content
+
+async def _gather(coroutines) -> list:
+    """Like asyncio.gather, but cancels the other parts when one fails, so no request keeps running unread."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def _messages(prompt: str, text: str, language: str) -> list:
+    return [{"role": "user", "content": prompt.format(language=language, text=text)}]
@@ -0,0 +1,69 @@
+import os
+from time import perf_counter
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+import metrics
+
+
+class MeteredHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest that reports the saturation of its connection pool:
+    requests in flight (current and peak), request latency and pool timeouts.
+    """
+
+    def __init__(self, name: str, connection_pool_size: int, keepalive_expiry: float = 30.0, **kwargs):
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            httpx_kwargs={"limits": httpx.Limits(
+                max_connections=connection_pool_size,
+                max_keepalive_connections=connection_pool_size,
+                keepalive_expiry=keepalive_expiry,
+            )},
+            **kwargs,
+        )
+        self.name = name
+        self.pool_size = connection_pool_size
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        metrics.set_gauge(f"http_pool.{name}.size", connection_pool_size)
+
+    async def do_request(self, *args, **kwargs):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        metrics.set_gauge(f"http_pool.{self.name}.in_flight", self.in_flight)
+        metrics.set_gauge(f"http_pool.{self.name}.peak_in_flight", self.peak_in_flight)
+        started = perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        except TimedOut as e:
+            if "pool" in str(e).lower():
+                metrics.inc(f"http_pool.{self.name}.pool_timeouts")
+            raise
+        finally:
+            self.in_flight -= 1
+            metrics.set_gauge(f"http_pool.{self.name}.in_flight", self.in_flight)
+            metrics.observe(f"http_pool.{self.name}.request", perf_counter() - started)
+
+
+def request_from_env(name: str, prefix: str, pool_size: int, timeout: float) -> MeteredHTTPXRequest:
+    """
+    Creates a MeteredHTTPXRequest configured by the environment variables
+    <prefix>_POOL_SIZE, <prefix>_HTTP_VERSION ("1.1" or "2"), <prefix>_KEEPALIVE_EXPIRY,
+    <prefix>_READ_TIMEOUT, <prefix>_WRITE_TIMEOUT, <prefix>_CONNECT_TIMEOUT and <prefix>_POOL_TIMEOUT.
+    """
+    def setting(key: str, default: float) -> float:
+        return float(os.environ.get(f"{prefix}_{key}", default))
+
+    return MeteredHTTPXRequest(
+        name,
+        connection_pool_size=int(setting("POOL_SIZE", pool_size)),
+        keepalive_expiry=setting("KEEPALIVE_EXPIRY", 30),
+        http_version=os.environ.get(f"{prefix}_HTTP_VERSION", "1.1"),
+        read_timeout=setting("READ_TIMEOUT", timeout),
+        write_timeout=setting("WRITE_TIMEOUT", timeout),
+        connect_timeout=setting("CONNECT_TIMEOUT", timeout),
+        pool_timeout=setting("POOL_TIMEOUT", timeout),
+    )
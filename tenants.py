@@ -0,0 +1,114 @@
+"""
+Bots served by this process.
+A single bot is configured with the TELEGRAM_BOT_TOKEN / TELEGRAM_ADMIN_ID environment variables.
+Several bots are listed in a JSON file passed with `python main.py --tenants tenants.json` (or TENANTS_CONFIG):
+
+    [
+        {"name": "briefify", "token": "...", "admin_id": 1},
+        {"name": "acme", "token_env": "ACME_BOT_TOKEN", "admin_id": 2, "languages": ["fr", "en"],
+         "messages": {"bot_greeting": {"fr": "Bonjour {user} !", "en": "Hello {user}!"}},
+         "max_usage": 100, "weight": 2}
+    ]
+
+Every bot runs as its own Application with its own sessions, update log and bot_data,
+all bots share the backend pool (see BackendPool, `weight` is the share of a bot).
+"""
+import json
+import os
+
+from telegram import InlineKeyboardMarkup
+from telegram.ext import Application
+
+import bot_conv
+from idempotency import UpdateLog, UPDATE_LOG_PATH
+from sessions import SessionStore, SESSION_DB_PATH
+from utils import keyboard_layout, precompile
+
+TENANTS_CONFIG = os.environ.get("TENANTS_CONFIG")
+
+# Defaults of the bot settings
+SUPPORTED_LANGUAGES = ['en', 'ru', 'fr']
+GITHUB_REPO = "https://github.com/RusaUB/BriefifyBot"
+
+# Restriction settings
+MAX_USAGE = 30 # 30 messages
+RESTRICTION_TIME = 5 * 60 # 5 minutes
+
+# Localized messages of bot_conv, a tenant can override any of them
+MESSAGES = {name: value for name, value in vars(bot_conv).items() if isinstance(value, dict) and not name.startswith("_")}
+
+
+class Tenant:
+    """Settings and per-bot state (sessions, update log) of one bot."""
+
+    def __init__(self, name: str, token: str, admin_id: int, languages: list = None, messages: dict = None,
+                 max_usage: int = MAX_USAGE, restriction_time: float = RESTRICTION_TIME, weight: float = 1,
+                 github_repo: str = GITHUB_REPO, persistence_path: str = None,
+                 session_db_path: str = SESSION_DB_PATH, update_log_path: str = UPDATE_LOG_PATH):
+        self.name = name
+        self.token = token
+        self.admin_id = int(admin_id)
+        self.languages = list(languages or SUPPORTED_LANGUAGES)
+        self.max_usage = max_usage
+        self.restriction_time = restriction_time
+        self.weight = weight
+        self.persistence_path = persistence_path
+        self.messages = {name: {**text, **(messages or {}).get(name, {})} for name, text in MESSAGES.items()}
+        missing = [(name, language) for name, text in self.messages.items() for language in self.languages if language not in text]
+        if missing:
+            raise ValueError(f"Tenant {name} has no translation of {missing}")
+        # Static fields are filled once instead of on every /start
+        self.start_pages = precompile(self.messages["start_page"], github_repo=github_repo)
+        self.language_keyboards = {
+            language: InlineKeyboardMarkup(keyboard_layout(language, self.languages, self.messages["lang_config"], self.messages["continue_text"]))
+            for language in self.languages
+        }
+        self.sessions = SessionStore(session_db_path)
+        self.update_log = UpdateLog(update_log_path)
+
+    def user_language(self, user) -> str:
+        """Returns the Telegram language of `user` if the bot supports it, else the first language of the bot."""
+        return user.language_code if user.language_code in self.languages else self.languages[0]
+
+
+class TenantApplication(Application):
+    """Application that knows the tenant it serves, see SessionContext.tenant."""
+
+    def __init__(self, *, tenant: Tenant, **kwargs):
+        super().__init__(**kwargs)
+        self.tenant = tenant
+
+
+def tenant_from_env() -> Tenant:
+    """The single bot configured with the environment variables."""
+    return Tenant(
+        name="default",
+        token=os.environ.get("TELEGRAM_BOT_TOKEN"),
+        admin_id=os.environ.get("TELEGRAM_ADMIN_ID"),
+        persistence_path=os.environ.get("PERSISTENCE_PATH"),
+    )
+
+def load_tenants(path: str) -> list:
+    """Creates the tenants listed in the JSON file at `path`, see the module docstring."""
+    with open(path) as file:
+        config = json.load(file)
+    tenants = []
+    for settings in config:
+        settings = dict(settings)
+        name = settings.pop("name")
+        if "token_env" in settings:
+            settings["token"] = os.environ[settings.pop("token_env")]
+        # Every tenant keeps its sessions and update log in its own files
+        settings.setdefault("session_db_path", _tenant_path(SESSION_DB_PATH, name))
+        settings.setdefault("update_log_path", _tenant_path(UPDATE_LOG_PATH, name))
+        tenants.append(Tenant(name, **settings))
+    if len({tenant.name for tenant in tenants}) != len(tenants):
+        raise ValueError(f"Tenant names in {path} are not unique")
+    return tenants
+
+def _tenant_path(path: str, name: str) -> str:
+    """sessions.sqlite3 -> sessions-<name>.sqlite3, in-memory and disabled paths are kept."""
+    if not path or path == ":memory:":
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-{name}{extension}"
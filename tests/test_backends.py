@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+
+from backends import BackendPool
+
+
+class StubBackend:
+    kind = "stub"
+    model = "stub"
+    slots = 1
+
+    async def stream(self, messages: list):
+        await asyncio.sleep(0.01)
+        yield "x"
+
+
+class BackendPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def test_release_skips_cancelled_waiters(self):
+        pool = BackendPool([StubBackend()])
+        holder = asyncio.create_task(pool.complete([]))
+        waiters = [asyncio.create_task(pool.complete([])) for _ in range(2)]
+        await asyncio.sleep(0.001)
+        # Like drain(), cancel the holder and a waiter in the same tick
+        holder.cancel()
+        waiters[0].cancel()
+        self.assertEqual(await asyncio.wait_for(waiters[1], 1), "x")
+        await asyncio.gather(holder, waiters[0], return_exceptions=True)
+        self.assertEqual(len(pool.free), 1)
+        self.assertEqual(pool.waiting, {})
+
+    async def test_fair_share_by_weight(self):
+        pool = BackendPool([StubBackend()], weights={"b": 2})
+        order = []
+
+        async def request(tenant):
+            await pool.complete([], tenant)
+            order.append(tenant)
+
+        await asyncio.gather(*(request("a") for _ in range(4)), *(request("b") for _ in range(8)))
+        # While both tenants wait, b gets two slots for every slot of a
+        self.assertEqual(order[:9].count("b"), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
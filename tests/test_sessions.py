@@ -0,0 +1,25 @@
+import unittest
+
+from sessions import SessionStore
+
+
+class SessionStoreTest(unittest.TestCase):
+    def test_long_language_survives_page_out(self):
+        store = SessionStore(":memory:", max_resident=1)
+        store.get(1)["language"] = "zh-hans"
+        # Loading another user pages the first one out
+        store.get(2)
+        self.assertEqual(store.get(1)["language"], "zh-hans")
+
+    def test_count_skips_blocked_users(self):
+        store = SessionStore(":memory:")
+        store.get(1)["language"] = "en"
+        store.get(2)["language"] = "fr"
+        store.get(2)["blocked"] = True
+        self.assertEqual(store.count(), 1)
+        del store.get(2)["blocked"]
+        self.assertEqual(store.count(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from prompting import estimate_tokens
+from summarize import summarize
+
+
+class VerbosePool:
+    """Answers every request with `length` words and records the prompts."""
+
+    def __init__(self, length: int):
+        self.length = length
+        self.prompts = []
+
+    async def complete(self, messages: list, tenant: str = None) -> str:
+        self.prompts.append(messages[0]["content"])
+        return " ".join(["word"] * self.length)
+
+    async def stream(self, messages: list, tenant: str = None):
+        self.prompts.append(messages[0]["content"])
+        yield "summary"
+
+
+class SummarizeTest(unittest.IsolatedAsyncioTestCase):
+    async def test_final_request_within_budget_when_merges_do_not_shrink(self):
+        # Every partial summary is longer than half of max_tokens
+        pool = VerbosePool(length=600)
+        chunks = [f"chunk {i}" for i in range(15)]
+        result = [content async for content in summarize(chunks, pool, "English", max_tokens=1000)]
+        self.assertEqual(result, ["summary"])
+        self.assertLessEqual(estimate_tokens(pool.prompts[-1]), 1000 + 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Voice note transcription. The speech model runs in worker processes started with
+`python transcribe.py`, which only import this module, not the bot.
+"""
+import asyncio
+import json
+import os
+import struct
+import sys
+from collections import OrderedDict
+from io import BytesIO
+from time import perf_counter
+
+import metrics
+
+# Transcription settings
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "base") # faster-whisper model size or path
+WHISPER_COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "int8")
+# Worker processes, one core is left to the event loop
+_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+TRANSCRIBE_WORKERS = int(os.environ.get("TRANSCRIBE_WORKERS", max(1, _CORES - 1)))
+MAX_TRANSCRIBE_QUEUE = int(os.environ.get("MAX_TRANSCRIBE_QUEUE", TRANSCRIBE_WORKERS * 4)) # waiting + running voice notes
+MAX_VOICE_DURATION = int(os.environ.get("MAX_VOICE_DURATION", 5 * 60)) # 5 minutes
+TRANSCRIPT_CACHE_SIZE = int(os.environ.get("TRANSCRIPT_CACHE_SIZE", 1000))
+
+
+# Requests to a worker are a little-endian length followed by the audio, answers one JSON line
+_LENGTH = struct.Struct("<I")
+
+
+class TranscriberBusy(Exception):
+    pass
+
+
+# Model of the worker process, loaded on its first voice note
+_model = None
+
+def _transcribe(data: bytes) -> tuple:
+    """
+    Runs in a worker process. Decodes the OGG/Opus voice note (faster-whisper decodes with
+    the FFmpeg libraries of PyAV) and returns (transcript, audio seconds, processing seconds).
+    """
+    global _model
+    if _model is None:
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError("Voice transcription requires the faster-whisper package")
+        # Every worker uses one thread, the pool already uses all cores
+        _model = WhisperModel(WHISPER_MODEL, device="cpu", compute_type=WHISPER_COMPUTE_TYPE, cpu_threads=1)
+    started = perf_counter()
+    segments, info = _model.transcribe(BytesIO(data), beam_size=1, vad_filter=True)
+    text = " ".join(segment.text.strip() for segment in segments)
+    return text, info.duration, perf_counter() - started
+
+def _serve() -> None:
+    """Worker process loop, transcribes the voice notes read from stdin until it is closed."""
+    # Anything the libraries print goes to stderr, stdout carries the answers
+    answers = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    requests = sys.stdin.buffer
+    while header := requests.read(_LENGTH.size):
+        data = requests.read(_LENGTH.unpack(header)[0])
+        try:
+            text, duration, processing = _transcribe(data)
+            answer = {"text": text, "duration": duration, "processing": processing}
+        except Exception as e:
+            answer = {"error": str(e)}
+        answers.write(json.dumps(answer).encode() + b"\n")
+        answers.flush()
+
+
+class Transcriber:
+    """
+    Transcribes voice notes with a local speech model in a pool of worker processes,
+    so decoding and inference never block the event loop or compete with it for the GIL.
+    Workers are started on demand and restarted after a failed or cancelled request.
+    Transcripts are cached by file_unique_id, which is the same for every bot and every
+    forward of a voice note.
+    """
+
+    def __init__(self, workers: int = TRANSCRIBE_WORKERS, max_queue: int = MAX_TRANSCRIBE_QUEUE,
+                 cache_size: int = TRANSCRIPT_CACHE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.queued = 0
+        # Idle workers, None stands for a worker that is not running
+        self.idle = None
+
+    def cached(self, file_unique_id: str):
+        """Returns the cached transcript of a voice note, or None."""
+        text = self.cache.get(file_unique_id)
+        if text is not None:
+            self.cache.move_to_end(file_unique_id)
+            metrics.inc("transcript_cache_hits")
+        return text
+
+    async def transcribe(self, file_unique_id: str, data: bytes) -> str:
+        """Returns the transcript of a voice note. Raises TranscriberBusy when MAX_TRANSCRIBE_QUEUE notes are queued."""
+        text = self.cached(file_unique_id)
+        if text is not None:
+            return text
+        if self.queued >= self.max_queue:
+            metrics.inc("transcriptions_rejected")
+            raise TranscriberBusy(f"{self.queued} voice notes queued")
+        self.queued += 1
+        metrics.set_gauge("transcribe_queue_depth", self.queued)
+        started = perf_counter()
+        try:
+            text, duration, processing = await self._run(data)
+        finally:
+            self.queued -= 1
+            metrics.set_gauge("transcribe_queue_depth", self.queued)
+        elapsed = perf_counter() - started
+        metrics.inc("transcriptions")
+        metrics.observe("transcribe", elapsed)
+        metrics.observe("transcribe_wait", elapsed - processing)
+        if duration:
+            # Real-time factor, processing time per second of audio
+            metrics.set_gauge("transcribe_rtf", round(processing / duration, 3))
+        self.cache[file_unique_id] = text
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return text
+
+    async def _run(self, data: bytes) -> tuple:
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for _ in range(self.workers):
+                self.idle.put_nowait(None)
+        process = await self.idle.get()
+        try:
+            if process is None or process.returncode is not None:
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, os.path.abspath(__file__),
+                    stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                )
+            process.stdin.write(_LENGTH.pack(len(data)) + data)
+            await process.stdin.drain()
+            line = await process.stdout.readline()
+            if not line:
+                raise RuntimeError("Transcription worker exited")
+        except BaseException:
+            # The worker may still be busy with the request, it is replaced
+            if process is not None and process.returncode is None:
+                process.kill()
+            process = None
+            raise
+        finally:
+            self.idle.put_nowait(process)
+        answer = json.loads(line)
+        if "error" in answer:
+            raise RuntimeError(answer["error"])
+        return answer["text"], answer["duration"], answer["processing"]
+
+    async def shutdown(self, timeout: float = 5) -> None:
+        """Stops the idle workers; busy ones are killed with their cancelled requests."""
+        if self.idle is None:
+            return
+        while not self.idle.empty():
+            process = self.idle.get_nowait()
+            if process is None or process.returncode is not None:
+                continue
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+        self.idle = None
+
+
+# Shared transcriber, the worker processes are started on the first voice note
+transcriber = Transcriber()
+
+
+if __name__ == "__main__":
+    _serve()
@@ -0,0 +1,92 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# Record every incoming update to this file (gzip compressed JSONL), disabled if unset
+TRACE_RECORD_PATH = os.environ.get("TRACE_RECORD_PATH")
+# Objects under these keys are chats, their "id" is anonymized. Users (objects with "id" and
+# "is_bot") are anonymized wherever they appear, e.g. in new_chat_members or left_chat_member
+CHAT_KEYS = {"chat", "sender_chat", "forward_from_chat"}
+# Personal fields that are dropped from anonymized objects
+PERSONAL_FIELDS = {"username", "first_name", "last_name", "title", "phone_number"}
+
+
+def anonymize(data, salt: bytes, key: str = None):
+    """
+    Returns a copy of an update dict with user and chat IDs replaced by salted hashes.
+    The same ID always maps to the same value, so a private chat keeps the ID of its user.
+    `key` is the key `data` is stored under in its parent.
+    """
+    if isinstance(data, list):
+        return [anonymize(item, salt, key) for item in data]
+    if not isinstance(data, dict):
+        return data
+    result = {child_key: anonymize(value, salt, child_key) for child_key, value in data.items()}
+    if "id" in result and ("is_bot" in result or key in CHAT_KEYS):
+        result = {k: v for k, v in result.items() if k not in PERSONAL_FIELDS}
+        result["id"] = anonymize_id(result["id"], salt)
+        if "is_bot" in result:
+            # first_name is required by telegram.User
+            result["first_name"] = "user"
+    return result
+
+def anonymize_id(value: int, salt: bytes) -> int:
+    digest = hashlib.blake2b(str(abs(value)).encode(), key=salt, digest_size=6).digest()
+    anonymized = int.from_bytes(digest, "big") % 10**12 + 1
+    return -anonymized if value < 0 else anonymized
+
+
+class TraceRecorder:
+    """
+    Writes incoming updates with their arrival time to a compressed JSONL trace.
+    Register `record` as a TypeHandler(Update) in a group that runs before the other handlers.
+    The salt of a trace is kept next to it in `<path>.salt`, so a user keeps the same
+    anonymized ID when later runs append to the trace.
+    """
+
+    def __init__(self, path: str, salt: bytes = None):
+        self.path = path
+        self.salt = salt or trace_salt(path)
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.count = 0
+
+    async def record(self, update, context) -> None:
+        try:
+            entry = {"t": time(), "update": anonymize(update.to_dict(), self.salt)}
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.count += 1
+            if self.count % 100 == 0:
+                self.file.flush()
+        except Exception as e:
+            logger.error(f"Error recording update: {e}")
+
+    def close(self) -> None:
+        self.file.close()
+        logger.info("Recorded %d updates to %s", self.count, self.path)
+
+
+def trace_salt(path: str) -> bytes:
+    """Returns the salt of the trace at `path`, creating it on the first run."""
+    salt_path = path + ".salt"
+    try:
+        # Only readable by the owner, the salt lets anyone with the trace link IDs to users
+        with open(os.open(salt_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as file:
+            salt = os.urandom(16)
+            file.write(salt)
+            return salt
+    except FileExistsError:
+        with open(salt_path, "rb") as file:
+            return file.read()
+
+def load_trace(path: str):
+    """Yields (timestamp, update dict) pairs from a trace written by TraceRecorder."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry["t"], entry["update"]
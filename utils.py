@@ -6,6 +6,18 @@ def get_key_from_value(dictionary, target_value):
             return key
     return None  # Return None if the value is not found in the dictionary
 
+class _KeepMissing(dict):
+    """format_map mapping that leaves unknown fields in place, e.g. "{user}"."""
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+def precompile(message: dict, **static) -> dict:
+    """
+    Fills the fields that never change (e.g. github_repo) into every language of a message once,
+    so message_text only formats the per-user fields at runtime.
+    """
+    return {language: text.format_map(_KeepMissing(static)) for language, text in message.items()}
+
 def message_text(language_code: str, message: dict, context: dict = None) -> str:
     if context is not None:
         formatted_message = message[language_code].format(**context)
@@ -17,4 +29,4 @@ def keyboard_layout(default_lang: str, supported_lang: list, lang_config: dict,
     for lang in supported_lang:
         if lang != default_lang:
             keyboard.append([InlineKeyboardButton(text=lang_config[lang], callback_data=lang)])
-    return keyboard
\ No newline at end of file
+    return keyboard
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from time import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Warm-up settings (seconds)
+WARMUP_INTERVAL = int(os.environ.get("WARMUP_INTERVAL", 240)) # ping loaded models every 4 minutes
+WARMUP_TIMEOUT = int(os.environ.get("WARMUP_TIMEOUT", 180)) # max time to wait for models at startup
+MIN_KEEP_ALIVE = int(os.environ.get("MIN_KEEP_ALIVE", 600)) # 10 minutes
+MAX_KEEP_ALIVE = int(os.environ.get("MAX_KEEP_ALIVE", 3600)) # 1 hour
+TRAFFIC_WINDOW = 15 * 60 # keep-alive is derived from the requests of the last 15 minutes
+
+
+class ModelWarmer:
+    """
+    Keeps the configured Ollama models loaded.
+    Preloads every model at startup, derives the keep_alive of each model from its
+    recent traffic and periodically pings the models used within their keep_alive.
+    Models without such traffic are left to Ollama, which unloads them when it expires.
+    """
+
+    def __init__(self, models: list, host: str = None):
+        self.models = list(models)
+        self.host = host
+        self.requests = {model: deque() for model in self.models}
+        self.last_used = {model: time() for model in self.models}
+        self.ready_models = set()
+        self.ping_job = None
+
+    def add(self, model: str) -> None:
+        """Adds `model` to the models that are preloaded and kept warm."""
+        if model not in self.models:
+            self.models.append(model)
+            self.requests[model] = deque()
+            self.last_used[model] = time()
+
+    def touch(self, model: str) -> None:
+        """Records a request to `model`. Call before every generation."""
+        now = time()
+        requests = self.requests.setdefault(model, deque())
+        requests.append(now)
+        while requests and requests[0] < now - TRAFFIC_WINDOW:
+            requests.popleft()
+        self.last_used[model] = now
+
+    def keep_alive(self, model: str) -> int:
+        """
+        Returns how long (in seconds) Ollama should keep `model` loaded.
+        Grows with the number of recent requests, bounded by MIN_KEEP_ALIVE and MAX_KEEP_ALIVE.
+        """
+        now = time()
+        recent = sum(1 for t in self.requests.get(model, ()) if t >= now - TRAFFIC_WINDOW)
+        return min(MAX_KEEP_ALIVE, MIN_KEEP_ALIVE + recent * 60)
+
+    def is_ready(self) -> bool:
+        return self.ready_models.issuperset(self.models)
+
+    async def warm(self, model: str) -> bool:
+        """Loads `model` with an empty prompt and refreshes its keep_alive."""
+        started = time()
+        try:
+            from ollama import AsyncClient
+
+            await AsyncClient(host=self.host).generate(model=model, prompt="", keep_alive=self.keep_alive(model))
+        except Exception as e:
+            self.ready_models.discard(model)
+            metrics.set_gauge(f"model_ready.{model}", 0)
+            metrics.inc(f"model_warmup_errors.{model}")
+            logger.warning("Warm-up of %s failed: %s", model, e)
+            return False
+        self.ready_models.add(model)
+        metrics.set_gauge(f"model_ready.{model}", 1)
+        metrics.observe(f"model_warmup.{model}", time() - started)
+        return True
+
+    async def wait_until_ready(self, timeout: float = WARMUP_TIMEOUT) -> bool:
+        """Warms all models, retrying failed ones until they are loaded or `timeout` expires."""
+        deadline = time() + timeout
+        while True:
+            pending = [model for model in self.models if model not in self.ready_models]
+            await asyncio.gather(*(self.warm(model) for model in pending))
+            if self.is_ready():
+                logger.info("Models ready: %s", ", ".join(self.models))
+                return True
+            if time() >= deadline:
+                logger.warning("Models not ready after %ss, starting anyway", timeout)
+                return False
+            await asyncio.sleep(5)
+
+    async def ping(self, context) -> None:
+        """JobQueue callback. Re-warms every model used within its current keep_alive."""
+        now = time()
+        await asyncio.gather(*(
+            self.warm(model) for model in self.models if now - self.last_used.get(model, 0) < self.keep_alive(model)
+        ))
+
+    async def post_init(self, application) -> None:
+        """
+        Application post_init hook.
+        run_polling only starts fetching updates once this returns, so updates are
+        accepted after the models are warm (or WARMUP_TIMEOUT expired).
+        """
+        await self.wait_until_ready()
+        if self.ping_job is not None:
+            # The warmer is shared by the applications of all tenants, one ping job is enough
+            return
+        if application.job_queue is not None:
+            self.ping_job = application.job_queue.run_repeating(self.ping, interval=WARMUP_INTERVAL, first=WARMUP_INTERVAL, name="model_warmup")
+        else:
+            logger.warning("JobQueue is not available, periodic model warm-up is disabled")